@@ -1,5 +1,12 @@
+import itertools
 import math
+import os
 import pathlib
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Iterator
 import tkinter as tk
 from tkinter import filedialog
 import numpy as np
@@ -83,81 +90,575 @@ def psnr(img1: np.ndarray, img2: np.ndarray) -> float:
         return 99.0
     return 10.0 * math.log10(1.0 / mse)
 
+def domain_positions_grid(H: int, W: int, dsize: int, domain_stride: int) -> np.ndarray:
+
+    ys = np.arange(0, H - dsize + 1, domain_stride, dtype=np.int32)
+    xs = np.arange(0, W - dsize + 1, domain_stride, dtype=np.int32)
+    yy, xx = np.meshgrid(ys, xs, indexing="ij")
+    return np.stack([yy.ravel(), xx.ravel()], axis=1)
+
+
+def isometries_batch(blocks: np.ndarray) -> np.ndarray:
+
+    # (n, r, r) -> (n, 8, r, r) following apply_isometry's t_id order
+    return np.stack([
+        blocks,
+        np.rot90(blocks, 1, axes=(1, 2)),
+        np.rot90(blocks, 2, axes=(1, 2)),
+        np.rot90(blocks, 3, axes=(1, 2)),
+        blocks[:, :, ::-1],
+        blocks[:, ::-1, :],
+        blocks.transpose(0, 2, 1),
+        blocks.transpose(0, 2, 1)[:, :, ::-1],
+    ], axis=1)
+
+
+def build_domain_pool(img: np.ndarray, rsize: int, domain_stride: int) -> dict:
+
+    """Downsampled domains under all 8 isometries as rows of a (n_domains*8, rsize*rsize)
+    matrix (row = 8*domain + t_id), plus their means, variances and centred rows."""
+
+    H, W = img.shape
+    dsize = 2 * rsize
+    positions = domain_positions_grid(H, W, dsize, domain_stride)
+
+    # avg2[y, x] is the 2x2 mean at (y, x), so a domain at (yD, xD) downsamples to
+    # avg2[yD:yD+dsize:2, xD:xD+dsize:2] -- same sum order as downsample2x
+    avg2 = 0.25 * (img[:-1, :-1] + img[1:, :-1] + img[:-1, 1:] + img[1:, 1:])
+    steps = 2 * np.arange(rsize)
+    rows = positions[:, 0, None] + steps
+    cols = positions[:, 1, None] + steps
+    blocks = avg2[rows[:, :, None], cols[:, None, :]]
+
+    pool = isometries_batch(blocks).reshape(len(positions) * 8, rsize * rsize).astype(np.float64)
+    mean = pool.mean(axis=1)
+    centred = pool - mean[:, None]
+    var = (centred ** 2).mean(axis=1)
+
+    return {
+        "positions": positions,
+        "pool": pool,
+        "mean": mean,
+        "var": var,
+        "centred": centred,
+    }
+
+
+def fit_affine_batch(
+    centred: np.ndarray,
+    d_mean: np.ndarray,
+    var_d: np.ndarray,
+    R: np.ndarray,
+    s_clip=(-1.0, 1.0),
+    s_bits: int | None = None,
+    o_bits: int | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+
+    """fit_affine for every candidate row at once: returns (s, o, mse) arrays.
+    With s_bits/o_bits, s and o are snapped to the bitstream grid (s before o is
+    fitted) and mse is the error of the quantized pair."""
+
+    r = R.reshape(-1).astype(np.float64)
+    r_mean = r.mean()
+    rc = r - r_mean
+    var_r = float((rc ** 2).mean())
+
+    cov = centred @ rc / r.size
+    flat = var_d < 1e-12
+    s = np.where(flat, 0.0, cov / np.where(flat, 1.0, var_d))
+    s = np.clip(s, s_clip[0], s_clip[1])
+    if s_bits is not None:
+        s = _dequantize(_quantize(s, *S_RANGE, s_bits), *S_RANGE, s_bits).astype(np.float64)
+    o = r_mean - s * d_mean
+
+    # mean((s*(d - d_mean) - (r - r_mean))**2) expanded
+    mse = np.maximum(s * s * var_d - 2.0 * s * cov + var_r, 0.0)
+    if o_bits is not None:
+        o_q = _dequantize(_quantize(o, *O_RANGE, o_bits), *O_RANGE, o_bits).astype(np.float64)
+        mse = mse + (o_q - o) ** 2
+        o = o_q
+    return s, o, mse
+
+
+# Fisher classification: a block's class is the brightness ordering of its four
+# quadrant means (24 orderings). The 8 isometries permute quadrants, so each
+# domain lands in a range's class under exactly one isometry of its major class.
+QUADRANT_PERMS = np.array(list(itertools.permutations(range(4))), dtype=np.int64)
+_PERM_CODE_TO_CLASS = np.full(256, -1, dtype=np.int64)
+_PERM_CODE_TO_CLASS[QUADRANT_PERMS @ np.array([64, 16, 4, 1])] = np.arange(len(QUADRANT_PERMS))
+_PAIRS_I, _PAIRS_J = np.triu_indices(4, k=1)
+
+
+def quadrant_means(blocks: np.ndarray) -> np.ndarray:
+
+    # (n, r, r) -> (n, 4) means of upper-left, upper-right, lower-left, lower-right
+    n, r, _ = blocks.shape
+    h = r // 2
+    q = blocks.reshape(n, 2, h, 2, h).mean(axis=(2, 4))
+    return q.reshape(n, 4)
+
+
+def block_classes(blocks: np.ndarray) -> np.ndarray:
+
+    order = np.argsort(-quadrant_means(blocks), axis=1, kind="stable")
+    return _PERM_CODE_TO_CLASS[order @ np.array([64, 16, 4, 1])]
+
+
+def class_ranking(R: np.ndarray) -> np.ndarray:
+
+    """All 24 classes sorted by how badly each ordering contradicts R's quadrant means
+    (sum of inverted pair differences); R's own class comes first."""
+
+    q = quadrant_means(R[None].astype(np.float64))[0]
+    qp = q[QUADRANT_PERMS]
+    inversions = np.maximum(qp[:, _PAIRS_J] - qp[:, _PAIRS_I], 0.0).sum(axis=1)
+    return np.argsort(inversions, kind="stable")
+
+
+def build_class_index(dp: dict, rsize: int) -> list[np.ndarray]:
+
+    """Pool rows grouped by Fisher class: index[c] holds the rows (8*domain + t_id) in class c."""
+
+    classes = block_classes(dp["pool"].reshape(-1, rsize, rsize))
+    order = np.argsort(classes, kind="stable")
+    bounds = np.searchsorted(classes[order], np.arange(len(QUADRANT_PERMS) + 1))
+    return [order[bounds[c]:bounds[c + 1]] for c in range(len(QUADRANT_PERMS))]
+
+
+SAUPE_FEATURE_SIDE = 4  # normalized blocks are averaged down to 4x4 = 16-D for the tree
+
+
+def _saupe_features(centred: np.ndarray, rsize: int) -> tuple[np.ndarray, np.ndarray]:
+
+    """Zero-mean rows -> unit-norm, reduced-dimension features (and which rows are non-flat)."""
+
+    # Largest block side up to SAUPE_FEATURE_SIDE that divides rsize; the full vector if none does
+    f = next((d for d in range(min(rsize, SAUPE_FEATURE_SIDE), 1, -1) if rsize % d == 0), rsize)
+    c = centred.reshape(-1, f, rsize // f, f, rsize // f).mean(axis=(2, 4)).reshape(-1, f * f)
+    norms = np.linalg.norm(c, axis=1)
+    ok = norms > 1e-9
+    feats = np.zeros_like(c)
+    feats[ok] = c[ok] / norms[ok, None]
+    return feats, ok
+
+
+def build_saupe_index(dp: dict, rsize: int) -> dict:
+
+    """Saupe's reduction: with o free and s unclipped, the fit error is
+    var(R) * (1 - cos^2(R, D)), so the best domains are the nearest neighbours of
+    +R or -R among normalized domain vectors. Indexed in a KD-tree over all
+    non-flat pool rows."""
+
+    # scipy is only needed when saupe_k is set
+    from scipy.spatial import cKDTree
+
+    feats, ok = _saupe_features(dp["centred"], rsize)
+    rows = np.flatnonzero(ok)
+    return {"tree": cKDTree(feats[rows]), "rows": rows, "rsize": rsize}
+
+
+def _saupe_candidates(R: np.ndarray, index: dict, k: int) -> np.ndarray:
+
+    rsize = index["rsize"]
+    r = R.reshape(1, -1).astype(np.float64)
+    q, _ = _saupe_features(r - r.mean(), rsize)
+    k = min(k, len(index["rows"]))
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    _, nn = index["tree"].query(np.concatenate([q, -q]), k=k)
+    return np.unique(index["rows"][np.asarray(nn).ravel()])
+
+
+def _search_range(
+    R: np.ndarray,
+    yR: int,
+    xR: int,
+    dp: dict,
+    class_index: list[np.ndarray] | None,
+    window_size: int | None,
+    max_domains_per_range: int | None,
+    top_k_classes: int,
+    rng=np.random,
+    saupe: tuple[dict, int] | None = None,
+    s_bits: int | None = None,
+    o_bits: int | None = None
+) -> tuple[int, int, int, float, float, float]:
+
+    """Best (yD, xD, t_id, s, o, mse) for range block R at (yR, xR) over the pool dp.
+    rng draws the max_domains_per_range subsample (global np.random by default).
+    saupe=(index, k) replaces the scan with the k nearest normalized domains of +R and -R;
+    the window, class and subsample limits still apply to those neighbours.
+    s_bits/o_bits rank domains by the quantized (s, o) a bitstream will carry."""
+
+    rsize = R.shape[0]
+    dsize = 2 * rsize
+    domain_positions = dp["positions"]
+    all_ids = np.arange(len(domain_positions))
+
+    candidates = all_ids
+    in_window = None
+
+    if window_size is not None:
+
+        cy = yR + rsize // 2
+        cx = xR + rsize // 2
+
+        dy = domain_positions[:, 0] + dsize // 2
+        dx = domain_positions[:, 1] + dsize // 2
+        in_window = (np.abs(dy - cy) <= window_size) & (np.abs(dx - cx) <= window_size)
+        candidates = all_ids[in_window]
+        if len(candidates) == 0:
+            candidates = all_ids
+            in_window = None
+
+    # Saupe neighbours and/or class rows, narrowed by the window and the subsample size
+    rows = None
+    if class_index is not None:
+        ranked = class_ranking(R)[:top_k_classes]
+        rows = np.concatenate([class_index[c] for c in ranked])
+    if saupe is not None:
+        nearest = _saupe_candidates(R, *saupe)
+        rows = nearest if rows is None else nearest[np.isin(nearest, rows)]
+    if rows is not None:
+        if in_window is not None:
+            rows = rows[in_window[rows // 8]]
+        if len(rows) == 0:
+            rows = None
+        elif max_domains_per_range is not None and len(rows) > max_domains_per_range:
+            idx = rng.choice(len(rows), size=max_domains_per_range, replace=False)
+            rows = np.sort(rows[idx])
+
+    if rows is None:
+        if max_domains_per_range is not None and len(candidates) > max_domains_per_range:
+            idx = rng.choice(len(candidates), size=max_domains_per_range, replace=False)
+            candidates = candidates[idx]
+
+        # Candidate-major, t_id-minor: argmin keeps the exhaustive loop's tie order
+        rows = (candidates[:, None] * 8 + np.arange(8)).ravel()
+
+    s, o, mse = fit_affine_batch(dp["centred"][rows], dp["mean"][rows], dp["var"][rows], R,
+                                 s_bits=s_bits, o_bits=o_bits)
+    k = int(np.argmin(mse))
+
+    yD, xD = domain_positions[rows[k] // 8]
+    return int(yD), int(xD), int(rows[k] % 8), float(s[k]), float(o[k]), float(mse[k])
+
+
+def _encode_row(
+    img: np.ndarray,
+    ry: int,
+    rsize: int,
+    dp: dict,
+    class_index: list[np.ndarray] | None,
+    window_size: int | None,
+    max_domains_per_range: int | None,
+    top_k_classes: int,
+    seed: int | None,
+    saupe: tuple[dict, int] | None = None,
+    s_bits: int | None = None,
+    o_bits: int | None = None
+) -> list[tuple]:
+
+    codes = []
+    yR = ry * rsize
+    for rx in range(img.shape[1] // rsize):
+        xR = rx * rsize
+        R = img[yR:yR + rsize, xR:xR + rsize]
+        # A per-block stream keeps subsampling independent of scheduling order
+        rng = np.random if seed is None else np.random.default_rng([seed, ry, rx])
+        code = _search_range(R, yR, xR, dp, class_index, window_size, max_domains_per_range,
+                             top_k_classes, rng, saupe, s_bits, o_bits)
+        codes.append(code[:5])
+    return codes
+
+
 def fractal_encode(
     img: np.ndarray,
     rsize: int = 8,
     domain_stride: int = 4,
     window_size: int | None = None,
-    max_domains_per_range: int | None = None
+    max_domains_per_range: int | None = None,
+    classify: bool = False,
+    top_k_classes: int = 1,
+    seed: int | None = None,
+    saupe_k: int | None = None,
+    s_bits: int | None = None,
+    o_bits: int | None = None
 ) -> dict:
 
     H, W = img.shape
     assert H % rsize == 0 and W % rsize == 0
-    dsize = 2 * rsize
 
-    domain_positions = []
-    for y in range(0, H - dsize + 1, domain_stride):
-        for x in range(0, W - dsize + 1, domain_stride):
-            domain_positions.append((y, x))
-    domain_positions = np.array(domain_positions, dtype=np.int32)
-
-    nRy = H // rsize
-    nRx = W // rsize
+    dp = build_domain_pool(img, rsize, domain_stride)
+    class_index = build_class_index(dp, rsize) if classify else None
+    saupe = (build_saupe_index(dp, rsize), saupe_k) if saupe_k else None
 
     codes = []
-    for ry in range(nRy):
-        for rx in range(nRx):
-            yR = ry * rsize
-            xR = rx * rsize
-            R = img[yR:yR + rsize, xR:xR + rsize]
+    for ry in range(H // rsize):
+        codes += _encode_row(img, ry, rsize, dp, class_index, window_size,
+                             max_domains_per_range, top_k_classes, seed, saupe,
+                             s_bits, o_bits)
+
+    return {
+        "H": H, "W": W,
+        "rsize": rsize,
+        "domain_stride": domain_stride,
+        "codes": np.array(codes, dtype=np.float32)  
+    }
+
 
-            candidates = domain_positions
+# Worker-side views onto the parent's shared-memory pool (set by _init_encode_worker)
+_SHARED: dict = {}
 
-            if window_size is not None:
 
-                cy = yR + rsize // 2
-                cx = xR + rsize // 2
+def _init_encode_worker(specs: dict, params: dict) -> None:
 
-                dy = candidates[:, 0] + dsize // 2
-                dx = candidates[:, 1] + dsize // 2
-                mask = (np.abs(dy - cy) <= window_size) & (np.abs(dx - cx) <= window_size)
-                candidates = candidates[mask]
-                if len(candidates) == 0:
-                    candidates = domain_positions  
+    _SHARED.clear()
+    handles = []
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        handles.append(shm)
+        _SHARED[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _SHARED["_handles"] = handles  # keep the mappings alive for the worker's lifetime
+    _SHARED["params"] = params
 
-            if max_domains_per_range is not None and len(candidates) > max_domains_per_range:
-                idx = np.random.choice(len(candidates), size=max_domains_per_range, replace=False)
-                candidates = candidates[idx]
 
-            best = (1e9, None)  
-            for (yD, xD) in candidates:
-                D_big = img[yD:yD + dsize, xD:xD + dsize]
-                D = downsample2x(D_big)  
+def _encode_row_shared(ry: int) -> list[tuple]:
 
-                for t_id in range(8):
-                    Dt = apply_isometry(D, t_id)
-                    s, o, mse = fit_affine(Dt, R, s_clip=(-1.0, 1.0))
-                    if mse < best[0]:
-                        best = (mse, (yD, xD, t_id, s, o))
+    p = _SHARED["params"]
+    dp = {name: _SHARED[name] for name in ("positions", "centred", "mean", "var")}
+    class_index = None
+    if p["classify"]:
+        bounds = _SHARED["class_bounds"]
+        rows = _SHARED["class_rows"]
+        class_index = [rows[bounds[c]:bounds[c + 1]] for c in range(len(bounds) - 1)]
+    return _encode_row(_SHARED["img"], ry, p["rsize"], dp, class_index, p["window_size"],
+                       p["max_domains_per_range"], p["top_k_classes"], p["seed"],
+                       s_bits=p["s_bits"], o_bits=p["o_bits"])
 
-            yD, xD, t_id, s, o = best[1]
-            codes.append((yD, xD, t_id, float(s), float(o)))
+
+def fractal_encode_parallel(
+    img: np.ndarray,
+    rsize: int = 8,
+    domain_stride: int = 4,
+    window_size: int | None = None,
+    max_domains_per_range: int | None = None,
+    classify: bool = False,
+    top_k_classes: int = 1,
+    seed: int = 0,
+    workers: int | None = None,
+    s_bits: int | None = None,
+    o_bits: int | None = None
+) -> dict:
+
+    """fractal_encode across a process pool. The domain pool is built once and placed
+    in shared memory; workers encode whole rows of range blocks. Output equals
+    fractal_encode(..., seed=seed) regardless of the number of workers."""
+
+    H, W = img.shape
+    assert H % rsize == 0 and W % rsize == 0
+
+    dp = build_domain_pool(img, rsize, domain_stride)
+    arrays = {
+        "img": np.ascontiguousarray(img),
+        "positions": dp["positions"],
+        "centred": dp["centred"],
+        "mean": dp["mean"],
+        "var": dp["var"],
+    }
+    if classify:
+        class_index = build_class_index(dp, rsize)
+        arrays["class_rows"] = np.concatenate(class_index)
+        arrays["class_bounds"] = np.cumsum([0] + [len(c) for c in class_index])
+    del dp
+
+    params = {
+        "rsize": rsize,
+        "window_size": window_size,
+        "max_domains_per_range": max_domains_per_range,
+        "classify": classify,
+        "top_k_classes": top_k_classes,
+        "seed": seed,
+        "s_bits": s_bits,
+        "o_bits": o_bits,
+    }
+
+    segments = []
+    try:
+        specs = {}
+        for name, a in arrays.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+            segments.append(shm)
+            np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)[...] = a
+            specs[name] = (shm.name, a.shape, a.dtype.str)
+        del arrays
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_encode_worker,
+                                 initargs=(specs, params)) as ex:
+            codes = []
+            for row in ex.map(_encode_row_shared, range(H // rsize)):
+                codes += row
+    finally:
+        for shm in segments:
+            shm.close()
+            shm.unlink()
 
     return {
         "H": H, "W": W,
         "rsize": rsize,
         "domain_stride": domain_stride,
-        "codes": np.array(codes, dtype=np.float32)  
+        "codes": np.array(codes, dtype=np.float32)
     }
 
-def fractal_decode(model: dict, n_iters: int = 10, init: str = "gray") -> np.ndarray:
+
+def fractal_encode_quadtree(
+    img: np.ndarray,
+    max_rsize: int = 16,
+    min_rsize: int = 4,
+    mse_threshold: float = 1e-3,
+    domain_stride: int = 4,
+    window_size: int | None = None,
+    max_domains_per_range: int | None = None,
+    classify: bool = False,
+    top_k_classes: int = 1,
+    saupe_k: int | None = None,
+    s_bits: int | None = None,
+    o_bits: int | None = None
+) -> dict:
+
+    """Adaptive partition: a range is split into 4 children while its best affine MSE
+    exceeds mse_threshold and the children are at least min_rsize. The split flags are
+    stored in preorder (one top-level block after another, raster order) in "quadtree"
+    and "codes" holds one row per leaf in the same order."""
+
+    H, W = img.shape
+    assert max_rsize % min_rsize == 0 and (max_rsize // min_rsize) & (max_rsize // min_rsize - 1) == 0, \
+        "max_rsize must be min_rsize times a power of two"
+    assert H % max_rsize == 0 and W % max_rsize == 0
+    assert min_rsize % 2 == 0
+
+    pools = {}
+
+    def pool(size: int) -> tuple:
+
+        # Built on first use, so sizes that no range is split down to cost nothing
+        if size not in pools:
+            dp = build_domain_pool(img, size, domain_stride)
+            pools[size] = (
+                dp,
+                build_class_index(dp, size) if classify else None,
+                (build_saupe_index(dp, size), saupe_k) if saupe_k else None,
+            )
+        return pools[size]
+
+    splits: list[int] = []
+    codes = []
+
+    def encode_block(yR: int, xR: int, size: int) -> None:
+
+        R = img[yR:yR + size, xR:xR + size]
+        dp, class_index, saupe = pool(size)
+        code = _search_range(R, yR, xR, dp, class_index, window_size, max_domains_per_range,
+                             top_k_classes, saupe=saupe, s_bits=s_bits, o_bits=o_bits)
+
+        if code[5] > mse_threshold and size // 2 >= min_rsize:
+            splits.append(1)
+            h = size // 2
+            for dy, dx in ((0, 0), (0, h), (h, 0), (h, h)):
+                encode_block(yR + dy, xR + dx, h)
+        else:
+            splits.append(0)
+            codes.append(code[:5])
+
+    for yR in range(0, H, max_rsize):
+        for xR in range(0, W, max_rsize):
+            encode_block(yR, xR, max_rsize)
+
+    return {
+        "H": H, "W": W,
+        "rsize": max_rsize,
+        "min_rsize": min_rsize,
+        "domain_stride": domain_stride,
+        "quadtree": np.array(splits, dtype=np.uint8),
+        "codes": np.array(codes, dtype=np.float32)
+    }
+
+
+def range_blocks(model: dict) -> list[tuple[int, int, int]]:
+
+    """(yR, xR, rsize) for every code row, for fixed-grid and quadtree models alike."""
+
     H, W = int(model["H"]), int(model["W"])
     rsize = int(model["rsize"])
-    dsize = 2 * rsize
-    codes = model["codes"]  
 
-    nRy = H // rsize
-    nRx = W // rsize
+    if "quadtree" not in model:
+        return [(y, x, rsize) for y in range(0, H, rsize) for x in range(0, W, rsize)]
+
+    flags = iter(np.asarray(model["quadtree"]).tolist())
+    leaves: list[tuple[int, int, int]] = []
+
+    def walk(yR: int, xR: int, size: int) -> None:
+        if next(flags):
+            h = size // 2
+            for dy, dx in ((0, 0), (0, h), (h, 0), (h, h)):
+                walk(yR + dy, xR + dx, h)
+        else:
+            leaves.append((yR, xR, size))
+
+    for yR in range(0, H, rsize):
+        for xR in range(0, W, rsize):
+            walk(yR, xR, rsize)
+    return leaves
+
+
+def decode_index_map(model: dict) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+
+    """Per output pixel (raster order): flat index into the 2x2-average image
+    (width W - 1) of its downsampled, isometry-mapped domain pixel, and its s, o."""
+
+    H, W = int(model["H"]), int(model["W"])
+    codes = np.asarray(model["codes"])
+    blocks = np.array(range_blocks(model), dtype=np.int64).reshape(-1, 3)
+
+    src = np.empty(H * W, dtype=np.int64)
+    s_pix = np.empty(H * W, dtype=np.float32)
+    o_pix = np.empty(H * W, dtype=np.float32)
+
+    for rsize in np.unique(blocks[:, 2]):
+        sel = np.flatnonzero(blocks[:, 2] == rsize)
+        r = int(rsize)
+        yR, xR = blocks[sel, 0], blocks[sel, 1]
+        yD = codes[sel, 0].astype(np.int64)
+        xD = codes[sel, 1].astype(np.int64)
+        t_id = codes[sel, 2].astype(np.int64)
+
+        # Dt[u, v] = D.flat[maps[t][u, v]] for each isometry
+        grid = np.arange(r * r).reshape(r, r)
+        maps = np.stack([apply_isometry(grid, t) for t in range(8)])[t_id]
+        di, dj = maps // r, maps % r
+
+        u = np.arange(r)
+        dest = (yR[:, None, None] + u[None, :, None]) * W + (xR[:, None, None] + u[None, None, :])
+        src[dest] = (yD[:, None, None] + 2 * di) * (W - 1) + (xD[:, None, None] + 2 * dj)
+        s_pix[dest] = codes[sel, 3][:, None, None]
+        o_pix[dest] = codes[sel, 4][:, None, None]
+
+    return src, s_pix, o_pix
+
+
+def fractal_decode(
+    model: dict,
+    n_iters: int = 10,
+    init: str = "gray",
+    tol: float | None = 1e-4
+) -> np.ndarray:
+
+    """Iterate the fractal operator up to n_iters times, stopping early once the
+    largest per-pixel change falls below tol (None always runs n_iters)."""
+
+    H, W = int(model["H"]), int(model["W"])
+    src, s_pix, o_pix = decode_index_map(model)
 
     if init == "random":
         cur = np.random.rand(H, W).astype(np.float32)
@@ -165,31 +666,345 @@ def fractal_decode(model: dict, n_iters: int = 10, init: str = "gray") -> np.nda
         cur = np.full((H, W), 0.5, dtype=np.float32)
 
     for _ in range(n_iters):
-        nxt = np.empty_like(cur)
-        idx = 0
-        for ry in range(nRy):
-            for rx in range(nRx):
-                yR = ry * rsize
-                xR = rx * rsize
-
-                yD = int(codes[idx, 0])
-                xD = int(codes[idx, 1])
-                t_id = int(codes[idx, 2])
-                s = float(codes[idx, 3])
-                o = float(codes[idx, 4])
-
-                D_big = cur[yD:yD + dsize, xD:xD + dsize]
-                D = downsample2x(D_big)
-                Dt = apply_isometry(D, t_id)
-                R_hat = s * Dt + o
-                nxt[yR:yR + rsize, xR:xR + rsize] = np.clip(R_hat, 0.0, 1.0)
-
-                idx += 1
+        avg2 = 0.25 * (cur[:-1, :-1] + cur[1:, :-1] + cur[:-1, 1:] + cur[1:, 1:])
+        nxt = avg2.reshape(-1)[src]
+        nxt *= s_pix
+        nxt += o_pix
+        np.clip(nxt, 0.0, 1.0, out=nxt)
+        nxt = nxt.reshape(H, W)
 
+        done = tol is not None and float(np.abs(nxt - cur).max()) < tol
         cur = nxt
+        if done:
+            break
 
     return cur
 
+# Bitstream: header, then (quadtree split flags, 1 bit each) and per range
+# block: domain grid index, isometry (3 bits), quantized s and o, optionally
+# deflated. s in [-1, 1] and o in [-1, 2] (the reachable range for s_clip=(-1, 1)
+# and pixel means in [0, 1]) are uniformly quantized as in Fisher (5 / 7 bits).
+MODEL_MAGIC = b"FIC1"
+MODEL_HEADER = struct.Struct(">4sBBIIHHHBBII")
+MODEL_FLAG_ENTROPY = 0x01
+MODEL_FLAG_QUADTREE = 0x02
+S_RANGE = (-1.0, 1.0)
+O_RANGE = (-1.0, 2.0)
+ISOMETRY_BITS = 3
+MODEL_VERSION = 2  # version 1 split each range into 2**bits - 1 steps, with no exact s = 0
+
+
+def _quant_steps(bits: int, version: int = MODEL_VERSION) -> int:
+    # An even number of steps puts the middle of the range (s = 0 for S_RANGE) on the grid
+    return (1 << bits) - (1 if version == 1 else 2)
+
+
+def _quantize(v: np.ndarray, lo: float, hi: float, bits: int) -> np.ndarray:
+    steps = _quant_steps(bits)
+    return np.rint((np.clip(v, lo, hi) - lo) / (hi - lo) * steps).astype(np.int64)
+
+
+def _dequantize(q: np.ndarray, lo: float, hi: float, bits: int, version: int = MODEL_VERSION) -> np.ndarray:
+    steps = _quant_steps(bits, version)
+    return (lo + q.astype(np.float64) * (hi - lo) / steps).astype(np.float32)
+
+
+def _pack_bits(values: np.ndarray, widths: np.ndarray) -> bytes:
+
+    """MSB-first concatenation of values[k] in widths[k] bits."""
+
+    values = np.asarray(values, dtype=np.int64)
+    widths = np.asarray(widths, dtype=np.int64)
+    total = int(widths.sum())
+    starts = np.cumsum(widths) - widths
+    bits = np.zeros(total, dtype=np.uint8)
+    for b in range(int(widths.max(initial=0))):
+        sel = widths > b
+        bits[starts[sel] + b] = (values[sel] >> (widths[sel] - 1 - b)) & 1
+    return np.packbits(bits).tobytes()
+
+
+def _unpack_bits(buf: bytes, widths: np.ndarray, bit_offset: int = 0) -> np.ndarray:
+
+    widths = np.asarray(widths, dtype=np.int64)
+    total = int(widths.sum())
+    bits = np.unpackbits(np.frombuffer(buf, dtype=np.uint8))
+    if bit_offset + total > len(bits):
+        raise ValueError("Truncated fractal bitstream")
+    bits = bits[bit_offset:bit_offset + total].astype(np.int64)
+    starts = np.cumsum(widths) - widths
+    values = np.zeros(len(widths), dtype=np.int64)
+    for b in range(int(widths.max(initial=0))):
+        sel = widths > b
+        values[sel] = (values[sel] << 1) | bits[starts[sel] + b]
+    return values
+
+
+def _domain_grid_shape(H: int, W: int, rsize: int, domain_stride: int) -> tuple[int, int]:
+    dsize = 2 * rsize
+    return len(range(0, H - dsize + 1, domain_stride)), len(range(0, W - dsize + 1, domain_stride))
+
+
+def _code_widths(model: dict, sizes: np.ndarray, s_bits: int, o_bits: int) -> np.ndarray:
+
+    # (n_codes, 4): domain index, isometry, s, o -- domain bits depend on the block size
+    H, W = int(model["H"]), int(model["W"])
+    stride = int(model["domain_stride"])
+    widths = np.empty((len(sizes), 4), dtype=np.int64)
+    for size in np.unique(sizes):
+        ny, nx = _domain_grid_shape(H, W, int(size), stride)
+        widths[sizes == size, 0] = max(ny * nx - 1, 0).bit_length()
+    widths[:, 1] = ISOMETRY_BITS
+    widths[:, 2] = s_bits
+    widths[:, 3] = o_bits
+    return widths
+
+
+def model_to_bytes(model: dict, s_bits: int = 5, o_bits: int = 7, entropy: bool = False) -> bytes:
+
+    # entropy=True deflates the payload; the packed codes are close to random, so it rarely pays.
+    # Encode with the same s_bits/o_bits so that o is fitted to the quantized s.
+    H, W = int(model["H"]), int(model["W"])
+    stride = int(model["domain_stride"])
+    codes = np.asarray(model["codes"], dtype=np.float64).reshape(-1, 5)
+    blocks = np.array(range_blocks(model), dtype=np.int64).reshape(-1, 3)
+    sizes = blocks[:, 2]
+    flags = np.asarray(model.get("quadtree", np.zeros(0)), dtype=np.int64)
+
+    fields = np.empty((len(codes), 4), dtype=np.int64)
+    for size in np.unique(sizes):
+        sel = sizes == size
+        _, nx = _domain_grid_shape(H, W, int(size), stride)
+        yD = codes[sel, 0].astype(np.int64)
+        xD = codes[sel, 1].astype(np.int64)
+        fields[sel, 0] = (yD // stride) * nx + xD // stride
+    fields[:, 1] = codes[:, 2].astype(np.int64)
+    fields[:, 2] = _quantize(codes[:, 3], *S_RANGE, s_bits)
+    fields[:, 3] = _quantize(codes[:, 4], *O_RANGE, o_bits)
+
+    widths = _code_widths(model, sizes, s_bits, o_bits)
+    payload = _pack_bits(
+        np.concatenate([flags, fields.ravel()]),
+        np.concatenate([np.ones(len(flags), dtype=np.int64), widths.ravel()])
+    )
+
+    header_flags = 0
+    if "quadtree" in model:
+        header_flags |= MODEL_FLAG_QUADTREE
+    if entropy:
+        header_flags |= MODEL_FLAG_ENTROPY
+        payload = zlib.compress(payload, 9)
+
+    header = MODEL_HEADER.pack(
+        MODEL_MAGIC, MODEL_VERSION, header_flags, H, W, int(model["rsize"]),
+        int(model.get("min_rsize", model["rsize"])), stride, s_bits, o_bits,
+        len(codes), len(flags)
+    )
+    return header + payload
+
+
+def model_from_bytes(blob: bytes) -> dict:
+
+    if len(blob) < MODEL_HEADER.size:
+        raise ValueError("Truncated fractal bitstream")
+    (magic, version, header_flags, H, W, rsize, min_rsize, stride,
+     s_bits, o_bits, n_codes, n_flags) = MODEL_HEADER.unpack_from(blob)
+    if magic != MODEL_MAGIC:
+        raise ValueError("Not a fractal model file")
+    if version not in (1, MODEL_VERSION):
+        raise ValueError(f"Unsupported fractal model version: {version}")
+
+    payload = blob[MODEL_HEADER.size:]
+    if header_flags & MODEL_FLAG_ENTROPY:
+        payload = zlib.decompress(payload)
+
+    model = {"H": H, "W": W, "rsize": rsize, "domain_stride": stride}
+    if header_flags & MODEL_FLAG_QUADTREE:
+        model["min_rsize"] = min_rsize
+        model["quadtree"] = _unpack_bits(payload, np.ones(n_flags, dtype=np.int64)).astype(np.uint8)
+
+    sizes = np.array(range_blocks(model), dtype=np.int64).reshape(-1, 3)[:, 2]
+    if len(sizes) != n_codes:
+        raise ValueError("Code count does not match the block layout")
+
+    widths = _code_widths(model, sizes, s_bits, o_bits)
+    fields = _unpack_bits(payload, widths.ravel(), bit_offset=n_flags).reshape(-1, 4)
+
+    codes = np.empty((n_codes, 5), dtype=np.float32)
+    for size in np.unique(sizes):
+        sel = sizes == size
+        _, nx = _domain_grid_shape(H, W, int(size), stride)
+        codes[sel, 0] = (fields[sel, 0] // nx) * stride
+        codes[sel, 1] = (fields[sel, 0] % nx) * stride
+    codes[:, 2] = fields[:, 1]
+    codes[:, 3] = _dequantize(fields[:, 2], *S_RANGE, s_bits, version)
+    codes[:, 4] = _dequantize(fields[:, 3], *O_RANGE, o_bits, version)
+    model["codes"] = codes
+    return model
+
+
+def save_model(model: dict, path, s_bits: int = 5, o_bits: int = 7, entropy: bool = False) -> int:
+
+    """Write the quantized bitstream to path; returns the file size in bytes."""
+
+    blob = model_to_bytes(model, s_bits, o_bits, entropy)
+    pathlib.Path(path).write_bytes(blob)
+    return len(blob)
+
+
+def load_model(path) -> dict:
+    return model_from_bytes(pathlib.Path(path).read_bytes())
+
+
+# Tiled container: header, then one record per (tile, channel) in encoding order,
+# each holding a model_to_bytes stream. Tiles and channels are encoded
+# independently, so memory is bounded by the tile size rather than the image.
+TILED_MAGIC = b"FICT"
+TILED_HEADER = struct.Struct(">4sBIIHB")   # magic, version, H, W, tile, channels
+TILE_RECORD = struct.Struct(">IIHHBI")     # y0, x0, h, w, channel, n_bytes
+
+
+def open_raw_image(path, H: int, W: int, channels: int = 3) -> np.ndarray:
+
+    """Memory-map a headerless 8-bit raster (H, W, channels) without reading it."""
+
+    return np.memmap(path, dtype=np.uint8, mode="r", shape=(H, W, channels))
+
+
+def rgb_to_ycbcr(rgb: np.ndarray) -> np.ndarray:
+
+    # JPEG (full range) YCbCr, all channels in [0, 1]
+    x = rgb.astype(np.float32) / 255.0
+    r, g, b = x[..., 0], x[..., 1], x[..., 2]
+    y = 0.299 * r + 0.587 * g + 0.114 * b
+    cb = 0.5 - 0.168736 * r - 0.331264 * g + 0.5 * b
+    cr = 0.5 + 0.5 * r - 0.418688 * g - 0.081312 * b
+    return np.stack([y, cb, cr], axis=-1)
+
+
+def ycbcr_to_rgb(ycc: np.ndarray) -> np.ndarray:
+
+    y, cb, cr = ycc[..., 0], ycc[..., 1] - 0.5, ycc[..., 2] - 0.5
+    r = y + 1.402 * cr
+    g = y - 0.344136 * cb - 0.714136 * cr
+    b = y + 1.772 * cb
+    rgb = np.stack([r, g, b], axis=-1)
+    return (np.clip(rgb, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+
+def _read_tile(source, y0: int, x0: int, h: int, w: int, channels: int) -> np.ndarray:
+
+    if isinstance(source, Image.Image):
+        mode = "RGB" if channels == 3 else "L"
+        tile = np.asarray(source.crop((x0, y0, x0 + w, y0 + h)).convert(mode))
+    else:
+        tile = np.asarray(source[y0:y0 + h, x0:x0 + w])
+    return tile.reshape(h, w, -1)[..., :channels]
+
+
+def compress_image_tiled(
+    source,
+    out_path,
+    tile: int = 256,
+    color: bool = True,
+    rsize: int = 8,
+    domain_stride: int = 4,
+    entropy: bool = False,
+    s_bits: int = 5,
+    o_bits: int = 7,
+    **encode_kwargs
+) -> int:
+
+    """Encode a PIL image or an (H, W[, C]) uint8 array/memmap tile by tile.
+    Colour is coded as Y at full resolution plus 2x-subsampled Cb and Cr; edge
+    tiles are edge-padded to the full tile size. Returns the output size in bytes."""
+
+    if isinstance(source, Image.Image):
+        W, H = source.size
+        channels = 3 if color and source.mode not in ("L", "1", "I", "F") else 1
+    else:
+        H, W = source.shape[:2]
+        channels = 3 if color and source.ndim == 3 and source.shape[2] >= 3 else 1
+    # Every coded plane needs room for one 2 * rsize domain; chroma planes are tile / 2
+    step = 4 * rsize if channels == 3 else 2 * rsize
+    if tile % step:
+        kind = "colour" if channels == 3 else "grayscale"
+        raise ValueError(f"tile must be a multiple of {step} for {kind} input with rsize={rsize}")
+
+    n_out = 0
+    with open(out_path, "wb") as f:
+        n_out += f.write(TILED_HEADER.pack(TILED_MAGIC, 1, H, W, tile, channels))
+        for y0 in range(0, H, tile):
+            for x0 in range(0, W, tile):
+                h, w = min(tile, H - y0), min(tile, W - x0)
+                px = _read_tile(source, y0, x0, h, w, channels)
+                px = np.pad(px, ((0, tile - h), (0, tile - w), (0, 0)), mode="edge")
+
+                if channels == 3:
+                    ycc = rgb_to_ycbcr(px)
+                    planes = [ycc[..., 0], downsample2x(ycc[..., 1]), downsample2x(ycc[..., 2])]
+                else:
+                    planes = [px[..., 0].astype(np.float32) / 255.0]
+
+                for c, plane in enumerate(planes):
+                    model = fractal_encode(np.ascontiguousarray(plane), rsize=rsize,
+                                           domain_stride=domain_stride, s_bits=s_bits,
+                                           o_bits=o_bits, **encode_kwargs)
+                    blob = model_to_bytes(model, s_bits, o_bits, entropy)
+                    n_out += f.write(TILE_RECORD.pack(y0, x0, h, w, c, len(blob)))
+                    n_out += f.write(blob)
+    return n_out
+
+
+def iter_tiles(in_path, n_iters: int = 10) -> Iterator[tuple[int, int, np.ndarray]]:
+
+    """Decode a tiled file one tile at a time: yields (y0, x0, uint8 pixels (h, w, C))."""
+
+    with open(in_path, "rb") as f:
+        head = f.read(TILED_HEADER.size)
+        if len(head) < TILED_HEADER.size:
+            raise ValueError("Truncated tiled fractal file")
+        magic, version, H, W, tile, channels = TILED_HEADER.unpack(head)
+        if magic != TILED_MAGIC or version != 1:
+            raise ValueError("Not a tiled fractal file")
+
+        planes: list[np.ndarray] = []
+        while True:
+            rec = f.read(TILE_RECORD.size)
+            if not rec:
+                break
+            if len(rec) < TILE_RECORD.size:
+                raise ValueError("Truncated tiled fractal file")
+            y0, x0, h, w, c, n = TILE_RECORD.unpack(rec)
+            blob = f.read(n)
+            if len(blob) != n:
+                raise ValueError("Truncated tiled fractal file")
+            planes.append(fractal_decode(model_from_bytes(blob), n_iters=n_iters))
+            if len(planes) < channels:
+                continue
+
+            if channels == 3:
+                up = [planes[0]] + [np.repeat(np.repeat(p, 2, axis=0), 2, axis=1) for p in planes[1:]]
+                px = ycbcr_to_rgb(np.stack(up, axis=-1))
+            else:
+                px = (np.clip(planes[0], 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)[..., None]
+            planes = []
+            yield y0, x0, px[:h, :w]
+
+
+def decompress_image_tiled(in_path, out: np.ndarray | None = None, n_iters: int = 10) -> np.ndarray:
+
+    """Reassemble a tiled file into out (e.g. a writable np.memmap) or a new array."""
+
+    with open(in_path, "rb") as f:
+        _, _, H, W, _, channels = TILED_HEADER.unpack(f.read(TILED_HEADER.size))
+    if out is None:
+        out = np.empty((H, W, channels), dtype=np.uint8)
+    for y0, x0, px in iter_tiles(in_path, n_iters):
+        out[y0:y0 + px.shape[0], x0:x0 + px.shape[1]] = px.reshape(px.shape[0], px.shape[1], -1)
+    return out
+
+
 def main():
     path = select_image_file()
     img = Image.open(path)
@@ -200,18 +1015,22 @@ def main():
         original,
         rsize=8,
         domain_stride=4,
-        window_size=64,              
-        max_domains_per_range=800    
+        window_size=64,
+        classify=True,
+        top_k_classes=2,
+        s_bits=5,
+        o_bits=7
     )
 
-    recon = fractal_decode(model, n_iters=10, init="gray")
+    # Decode what would actually be shipped: the quantized bitstream
+    blob = model_to_bytes(model, s_bits=5, o_bits=7)
+    recon = fractal_decode(model_from_bytes(blob), n_iters=10, init="gray")
 
     p = psnr(original, recon)
     print(f"PSNR: {p:.2f} dB")
 
-    approx_bytes = model["codes"].size * 4  
     orig_bytes = original.size  
-    print(f"Approx model bytes: {approx_bytes:,}")
+    print(f"Model bytes: {len(blob):,} ({8 * len(blob) / orig_bytes:.3f} bpp)")
     print(f"Pixels: {original.shape[0]}x{original.shape[1]} ({orig_bytes:,} pixels)")
 
     plt.figure()
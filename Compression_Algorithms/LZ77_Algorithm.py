@@ -1,7 +1,22 @@
 from __future__ import annotations
 
+import bisect
+import heapq
+import io
+import mmap
+import os
+import struct
+import time
+import zlib
+from array import array
+from collections import deque
+from itertools import islice
+from operator import attrgetter
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import List, Tuple
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Tuple, Union
+
+import numpy as np
 
 
 @dataclass(frozen=True)
@@ -11,90 +26,1237 @@ class Token:
     next_byte: int | None  
 
 
-def _find_longest_match(data: bytes, pos: int, window_size: int, lookahead_size: int) -> Tuple[int, int]:
+class TokenArray:
 
-    start = max(0, pos - window_size)
-    window = data[start:pos]
-    lookahead = data[pos:pos + lookahead_size]
+    """Token container backed by parallel arrays (~10 bytes per token instead of a Token object)."""
 
-    best_length = 0
-    best_offset = 0
+    def __init__(self):
+        self.offsets = array("I")
+        self.lengths = array("I")
+        self.next_bytes = array("B")
+        self.has_next = array("B")  # 0 when next_byte is None
 
-    if not window or not lookahead:
-        return 0, 0
+    def append_fields(self, offset: int, length: int, next_byte: int | None) -> None:
 
-    for w_i in range(len(window)):
-        length = 0
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        if next_byte is None:
+            self.next_bytes.append(0)
+            self.has_next.append(0)
+        else:
+            self.next_bytes.append(next_byte)
+            self.has_next.append(1)
 
-        while (length < len(lookahead)) and (w_i + length < len(window)) and (window[w_i + length] == lookahead[length]):
-            length += 1
+    def append(self, tok: Token) -> None:
+        self.append_fields(tok.offset, tok.length, tok.next_byte)
 
-        if length > best_length:
-            best_length = length
+    def extend(self, tokens: Iterable[Token]) -> None:
 
-            best_offset = len(window) - w_i
+        if isinstance(tokens, TokenArray):
+            self.offsets.extend(tokens.offsets)
+            self.lengths.extend(tokens.lengths)
+            self.next_bytes.extend(tokens.next_bytes)
+            self.has_next.extend(tokens.has_next)
+            return
+        for tok in tokens:
+            self.append_fields(tok.offset, tok.length, tok.next_byte)
 
-        if best_length == len(lookahead):
-            break
+    def __len__(self) -> int:
+        return len(self.offsets)
 
-    if best_length == 0:
-        return 0, 0
+    def __getitem__(self, i: int) -> Token:
+        return Token(self.offsets[i], self.lengths[i], self.next_bytes[i] if self.has_next[i] else None)
 
-    return best_offset, best_length
+    def __iter__(self) -> Iterator[Token]:
 
+        for offset, length, next_byte, has in zip(self.offsets, self.lengths, self.next_bytes, self.has_next):
+            yield Token(offset, length, next_byte if has else None)
 
-def compress_lz77(data: bytes, window_size: int = 4096, lookahead_size: int = 18) -> List[Token]:
+    def __eq__(self, other) -> bool:
+
+        if isinstance(other, TokenArray):
+            return (
+                self.offsets == other.offsets and self.lengths == other.lengths
+                and self.has_next == other.has_next and self.next_bytes == other.next_bytes
+            )
+        return NotImplemented
+
+    def columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+
+        """Zero-copy NumPy views: (offsets, lengths, next_bytes, has_next)."""
+
+        return (
+            np.frombuffer(self.offsets, dtype=np.uint32),
+            np.frombuffer(self.lengths, dtype=np.uint32),
+            np.frombuffer(self.next_bytes, dtype=np.uint8),
+            np.frombuffer(self.has_next, dtype=np.uint8),
+        )
+
+    @classmethod
+    def from_columns(cls, offsets, lengths, next_bytes, has_next) -> TokenArray:
+
+        arr = cls()
+        arr.offsets = array("I", np.asarray(offsets, dtype=np.uint32).tobytes())
+        arr.lengths = array("I", np.asarray(lengths, dtype=np.uint32).tobytes())
+        arr.next_bytes = array("B", np.asarray(next_bytes, dtype=np.uint8).tobytes())
+        arr.has_next = array("B", np.asarray(has_next, dtype=np.uint8).tobytes())
+        return arr
+
+    def to_bytes(self) -> bytes:
+
+        """Vectorized tokens_to_bytes: 4 bytes per record, plus next_byte when present."""
+
+        if len(self) == 0:
+            return b""
+        offsets, lengths, next_bytes, has_next = self.columns()
+        if offsets.max() > 65535:
+            raise ValueError("offset out of range for this serialization")
+        if lengths.max() > 255:
+            raise ValueError("length out of range for this serialization")
+
+        has = has_next.astype(bool)
+        sizes = 4 + has.astype(np.int64)
+        starts = np.cumsum(sizes) - sizes
+        out = np.empty(int(sizes.sum()), dtype=np.uint8)
+        out[starts] = offsets >> 8
+        out[starts + 1] = offsets & 0xFF
+        out[starts + 2] = lengths
+        out[starts + 3] = np.where(has, 0, 1)
+        out[starts[has] + 4] = next_bytes[has]
+        return out.tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> TokenArray:
+
+        # Record boundaries depend on each flag, so only the walk is sequential
+        n = len(blob)
+        starts = array("q")
+        i = 0
+        while i + 4 <= n:
+            flag = blob[i + 3]
+            starts.append(i)
+            if flag == 1:
+                i += 4
+            elif flag == 0:
+                if i + 4 >= n:
+                    raise ValueError("Blob truncated (next_byte needed)")
+                i += 5
+            else:
+                raise ValueError("Invalid Flag")
+        if i != n:
+            raise ValueError("Truncated Blob")
+
+        buf = np.frombuffer(blob, dtype=np.uint8)
+        st = np.frombuffer(starts, dtype=np.int64)
+        offsets = (buf[st].astype(np.uint32) << 8) | buf[st + 1]
+        has = buf[st + 3] == 0
+        next_bytes = np.zeros(len(st), dtype=np.uint8)
+        next_bytes[has] = buf[st[has] + 4]
+        return cls.from_columns(offsets, buf[st + 2], next_bytes, has)
+
+
+MIN_MATCH = 3
+
+# The matcher only indexes and slices its input (lookahead-sized slices, never
+# the window), so mmap and memoryview inputs are searched in place.
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+def _match_length(data: Buffer, a: int, b: int, max_len: int) -> int:
+
+    """Common prefix length of data[a:] and data[b:], capped at max_len."""
+
+    n = 0
+    # Short matches dominate: a byte loop avoids allocating slices per candidate
+    while n < max_len and n < 8:
+        if data[a + n] != data[b + n]:
+            return n
+        n += 1
+    if n >= max_len or data[a + n:a + max_len] == data[b + n:b + max_len]:
+        return max_len
+
+    # Binary search over prefix equality: lo is known equal, hi known different
+    lo, hi = n, max_len
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if data[a + lo:a + mid] == data[b + lo:b + mid]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+HASH_BITS = 17
+HASH_SEGMENT = 1 << 16
+
+
+class _HashChain:
+
+    """Hash chains over 3-byte prefixes. Positions are indexed in NumPy batches of
+    HASH_SEGMENT ahead of the parser instead of one dict update per byte, so the
+    parse loop only pays per token. Chains are hashed, so a candidate may share
+    the bucket but not the prefix; match lengths are always verified."""
+
+    def __init__(self, window_size: int, max_chain: int):
+        if window_size <= 0:
+            raise ValueError("window_size must be positive")
+        if max_chain <= 0:
+            raise ValueError("max_chain must be positive")
+        self.window_size = window_size
+        self.max_chain = max_chain
+        # head: 1 + last position indexed in each bucket (0 = empty)
+        # prev: ring (pos % ring_size) with the previous position in the same bucket;
+        # one extra segment of room so positions indexed ahead never evict the window
+        self.head = np.zeros(1 << HASH_BITS, dtype=np.int64)
+        self.ring_size = window_size + HASH_SEGMENT
+        self.prev = [-1] * self.ring_size
+        self.indexed = 0  # every position below this is in the chains
+
+    # Positions are absolute stream positions; data[0] is position `base`
+    def extend(self, data: Buffer, stop: int, base: int = 0) -> None:
+
+        """Index positions [indexed, stop), clamped to those with 3 bytes in data.
+        Callers keep stop <= parse position + HASH_SEGMENT."""
+
+        stop = min(stop, base + len(data) - MIN_MATCH + 1)
+        # Positions already dropped from a streaming buffer are out of the window anyway
+        self.indexed = max(self.indexed, base)
+        while self.indexed < stop:
+            self._index_segment(data, self.indexed, min(stop, self.indexed + HASH_SEGMENT), base)
+
+    def _index_segment(self, data: Buffer, start: int, stop: int, base: int) -> None:
+
+        cnt = stop - start
+        i = start - base
+        b = np.frombuffer(data, dtype=np.uint8)
+        key = (b[i:i + cnt].astype(np.uint32) << 16) | (b[i + 1:i + 1 + cnt].astype(np.uint32) << 8) | b[i + 2:i + 2 + cnt]
+        del b  # release the buffer export (bytearrays cannot resize while viewed)
+        key = (key * np.uint32(2654435761)) >> np.uint32(32 - HASH_BITS)
+
+        # Within the batch, a position's predecessor is the previous one in a stable sort by bucket
+        order = np.argsort(key, kind="stable")
+        sk = key[order]
+        same = sk[1:] == sk[:-1]
+        prev = np.empty(cnt, dtype=np.int64)
+        prev[order[1:][same]] = order[:-1][same] + start
+        first = np.ones(cnt, dtype=bool)
+        first[1:] = ~same
+        last = np.ones(cnt, dtype=bool)
+        last[:-1] = ~same
+        buckets = sk[first]
+        prev[order[first]] = self.head[buckets] - 1
+        self.head[buckets] = order[last] + start + 1
+
+        r = start % self.ring_size
+        k = min(cnt, self.ring_size - r)
+        self.prev[r:r + k] = prev[:k].tolist()
+        if k < cnt:
+            self.prev[:cnt - k] = prev[k:].tolist()
+        self.indexed = stop
+
+    def find(self, data: Buffer, pos: int, lookahead_size: int, base: int = 0) -> Tuple[int, int]:
+
+        """Longest match for pos among positions pos - window_size .. pos - 1."""
+
+        i = pos - base
+        max_len = min(lookahead_size, len(data) - i)
+        if max_len < MIN_MATCH:
+            return 0, 0
+        if pos >= self.indexed:
+            self.extend(data, pos + HASH_SEGMENT, base)
+
+        limit = max(pos - self.window_size, base)
+        prev = self.prev
+        ring_size = self.ring_size
+        cand = prev[pos % ring_size]
+
+        best_length = 0
+        best_offset = 0
+        chain = self.max_chain
+
+        while cand >= limit and chain > 0:
+            c = cand - base
+            # Cheap reject: a longer match must also agree at best_length
+            if data[c + best_length] == data[i + best_length]:
+                length = _match_length(data, c, i, max_len)
+                if length > best_length:
+                    best_length = length
+                    best_offset = pos - cand
+                    if length == max_len:
+                        break
+            cand = prev[cand % ring_size]
+            chain -= 1
+
+        if best_length < MIN_MATCH:
+            return 0, 0
+
+        return best_offset, best_length
+
+
+def _greedy_run(
+    chain: _HashChain,
+    data: Buffer,
+    pos: int,
+    stop: int,
+    lookahead_size: int,
+    emit: Callable[[int, int, int | None], None],
+    base: int = 0
+) -> int:
+
+    """Greedy tokens starting at every position below stop, passed to emit(offset,
+    length, next_byte); returns the position after the last token. This is
+    _HashChain.find inlined, since compression time is spent here."""
+
+    prev = chain.prev
+    ring_size = chain.ring_size
+    window_size = chain.window_size
+    max_chain = chain.max_chain
+    n = len(data)
+    indexed = chain.indexed
+
+    while pos < stop:
+        i = pos - base
+        max_len = n - i
+        if max_len > lookahead_size:
+            max_len = lookahead_size
+        if max_len < MIN_MATCH:
+            emit(0, 0, data[i])
+            pos += 1
+            continue
+        if pos >= indexed:
+            chain.extend(data, pos + HASH_SEGMENT, base)
+            indexed = chain.indexed
+
+        limit = pos - window_size
+        if limit < base:
+            limit = base
+        cand = prev[pos % ring_size]
+
+        best_length = 0
+        best_offset = 0
+        budget = max_chain
+        while cand >= limit and budget > 0:
+            c = cand - base
+            if data[c + best_length] == data[i + best_length]:
+                length = _match_length(data, c, i, max_len)
+                if length > best_length:
+                    best_length = length
+                    best_offset = pos - cand
+                    if length == max_len:
+                        break
+            cand = prev[cand % ring_size]
+            budget -= 1
+
+        if best_length < MIN_MATCH:
+            emit(0, 0, data[i])
+            pos += 1
+            continue
+
+        next_i = i + best_length
+        if next_i < n:
+            emit(best_offset, best_length, data[next_i])
+            pos += best_length + 1
+        else:
+            emit(best_offset, best_length, None)
+            pos += best_length
+
+    return pos
+
+
+LEVEL_FAST = 1     # greedy with a shallow hash chain
+LEVEL_GREEDY = 2   # take the longest match at every position
+LEVEL_LAZY = 3     # defer a match when pos + 1 has a longer one
+LEVEL_OPTIMAL = 4  # shortest path over the version 2 bit cost model
+LEVEL_NAMES = {LEVEL_FAST: "fast", LEVEL_GREEDY: "greedy", LEVEL_LAZY: "lazy", LEVEL_OPTIMAL: "optimal"}
+FAST_MAX_CHAIN = 4
+OPTIMAL_SEGMENT = 1 << 16  # the optimal parse keeps per-byte state for one segment at a time
+
+
+def _lazy_parse(
+    data: Buffer,
+    window_size: int,
+    lookahead_size: int,
+    max_chain: int
+) -> Iterator[Tuple[int, int, int | None]]:
 
-    tokens: List[Token] = []
     pos = 0
     n = len(data)
+    chain = _HashChain(window_size, max_chain)
+    pending = None     # match already searched for pos (after a deferral)
 
     while pos < n:
-        offset, length = _find_longest_match(data, pos, window_size, lookahead_size)
+        offset, length = pending if pending is not None else chain.find(data, pos, lookahead_size)
+        pending = None
 
-        if offset == 0 or length == 0:
-            # literal: (0,0,byte)
-            tokens.append(Token(0, 0, data[pos]))
+        if length and pos + 1 < n:
+            nxt = chain.find(data, pos + 1, lookahead_size)
+            if nxt[1] > length:
+                yield 0, 0, data[pos]
+                pos += 1
+                pending = nxt
+                continue
+
+        if length == 0:
+            yield 0, 0, data[pos]
             pos += 1
+            continue
+
+        next_pos = pos + length
+        next_byte = data[next_pos] if next_pos < n else None
+        yield offset, length, next_byte
+        pos = next_pos + (1 if next_byte is not None else 0)
+
+
+def _optimal_parse(
+    data: Buffer,
+    window_size: int,
+    lookahead_size: int,
+    max_chain: int
+) -> Iterator[Tuple[int, int, int | None]]:
+
+    n = len(data)
+    offset_bits = (window_size - 1).bit_length()
+    length_bits = (lookahead_size - 1).bit_length()
+    literal_cost = 9
+    match_cost = 1 + offset_bits + length_bits + 8
+    tail_cost = match_cost - 8  # final match without next_byte
+    chain = _HashChain(window_size, max_chain)
+    inf = 1 << 62
+
+    # Shortest path over one segment at a time; matches still reach back into earlier
+    # segments, but a token never crosses a segment end
+    for base in range(0, n, OPTIMAL_SEGMENT):
+        end = min(base + OPTIMAL_SEGMENT, n)
+        size = end - base
+
+        # cost[j]: cheapest bit cost of data[base:base + j]; from_pos/offsets/lengths: last token into j
+        cost = array("q", [0]) + array("q", [inf]) * size
+        from_pos = array("q", [0]) * (size + 1)
+        offsets = array("I", [0]) * (size + 1)
+        lengths = array("I", [0]) * (size + 1)
+
+        for i in range(size):
+            c = cost[i]
+            offset, length = chain.find(data, base + i, lookahead_size)
+
+            if c + literal_cost < cost[i + 1]:
+                cost[i + 1] = c + literal_cost
+                from_pos[i + 1] = i
+                lengths[i + 1] = 0
+
+            # Every length uses the same number of bits, so shorter prefixes of the
+            # longest match are the only other edges worth considering
+            for ln in range(MIN_MATCH, length + 1):
+                j = i + ln
+                if base + j < n:
+                    j += 1
+                    cc = c + match_cost
+                else:
+                    cc = c + tail_cost
+                if j > size:
+                    break
+                if cc < cost[j]:
+                    cost[j] = cc
+                    from_pos[j] = i
+                    offsets[j] = offset
+                    lengths[j] = ln
+
+        path = []
+        j = size
+        while j > 0:
+            path.append(j)
+            j = from_pos[j]
+
+        for j in reversed(path):
+            ln = lengths[j]
+            if ln == 0:
+                yield 0, 0, data[base + j - 1]
+            else:
+                i = base + from_pos[j]
+                yield offsets[j], ln, data[i + ln] if i + ln < n else None
+
+
+def compress_lz77(
+    data: Buffer,
+    window_size: int = 4096,
+    lookahead_size: int = 18,
+    max_chain: int = 64,
+    compact: bool = False,
+    level: int = LEVEL_GREEDY
+) -> List[Token] | TokenArray:
+
+    if compact:
+        arr = TokenArray()
+        emit = arr.append_fields
+    else:
+        tokens: List[Token] = []
+        append = tokens.append
+        emit = lambda offset, length, next_byte: append(Token(offset, length, next_byte))  # noqa: E731
+
+    if level in (LEVEL_FAST, LEVEL_GREEDY):
+        depth = min(max_chain, FAST_MAX_CHAIN) if level == LEVEL_FAST else max_chain
+        _greedy_run(_HashChain(window_size, depth), data, 0, len(data), lookahead_size, emit)
+    elif level in (LEVEL_LAZY, LEVEL_OPTIMAL):
+        parse = _lazy_parse if level == LEVEL_LAZY else _optimal_parse
+        for offset, length, next_byte in parse(data, window_size, lookahead_size, max_chain):
+            emit(offset, length, next_byte)
+    else:
+        raise ValueError(f"level must be one of {sorted(LEVEL_NAMES)}")
+
+    return arr if compact else tokens
+
+
+def compress_mapped(
+    path,
+    window_size: int = 4096,
+    lookahead_size: int = 18,
+    max_chain: int = 64,
+    compact: bool = True,
+    level: int = LEVEL_GREEDY
+) -> List[Token] | TokenArray:
+
+    """compress_lz77 over a read-only memory map of path: the file is mapped once
+    and shared with the page cache instead of being copied into a bytes object."""
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return compress_lz77(b"", window_size, lookahead_size, max_chain, compact, level)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                return compress_lz77(view, window_size, lookahead_size, max_chain, compact, level)
+            finally:
+                view.release()
+
+
+def benchmark_levels(
+    data: Buffer,
+    window_size: int = 4096,
+    lookahead_size: int = 18,
+    max_chain: int = 64,
+    levels: Iterable[int] = tuple(LEVEL_NAMES)
+) -> List[dict]:
+
+    """Time each level on data; ratio is the version 2 packed size over the input size."""
+
+    results = []
+    for level in levels:
+        t0 = time.perf_counter()
+        tokens = compress_lz77(data, window_size, lookahead_size, max_chain, level=level)
+        seconds = time.perf_counter() - t0
+        if decompress_lz77(tokens) != data:
+            raise AssertionError(f"Roundtrip failed at level {level}")
+        packed = tokens_to_bytes(tokens, version=VERSION_PACKED,
+                                 window_size=window_size, lookahead_size=lookahead_size)
+        results.append({
+            "level": level,
+            "name": LEVEL_NAMES[level],
+            "seconds": seconds,
+            "bytes_per_sec": len(data) / seconds if seconds > 0 else float("inf"),
+            "n_tokens": len(tokens),
+            "compressed_bytes": len(packed),
+            "ratio": len(packed) / len(data) if data else 1.0,
+        })
+    return results
+
+
+def _repeat_match(out: bytearray, start: int, offset: int, length: int) -> bytes:
+
+    # Overlapping match (offset < length): the last `offset` bytes are a period
+    pattern = bytes(out[start:start + offset])
+    reps, rem = divmod(length, offset)
+    return pattern * reps + pattern[:rem]
+
+
+def _token_columns(tokens: Iterable[Token]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+
+    """(offsets, lengths, next_bytes, has_next) as int64 arrays, read straight from a
+    TokenArray or in one pass over Token objects."""
+
+    if isinstance(tokens, TokenArray):
+        return tuple(c.astype(np.int64) for c in tokens.columns())
+    tokens = tokens if isinstance(tokens, list) else list(tokens)
+    n = len(tokens)
+    # None -> -1 through an object array keeps the per-token work in C
+    nexts = np.array(list(map(attrgetter("next_byte"), tokens)), dtype=object)
+    has_next = np.not_equal(nexts, None)
+    nexts[~has_next] = 0
+    return (
+        np.fromiter(map(attrgetter("offset"), tokens), dtype=np.int64, count=n),
+        np.fromiter(map(attrgetter("length"), tokens), dtype=np.int64, count=n),
+        nexts.astype(np.int64),
+        has_next.astype(np.int64),
+    )
+
+
+def _raise_invalid_token(tok: Token, out_len: int) -> None:
+
+    if tok.length:
+        if tok.offset <= 0:
+            raise ValueError(f"Token inválido: {tok}")
+        raise ValueError(f"Offset fuera de rango: {tok.offset} con salida len={out_len}")
+    if tok.offset:
+        raise ValueError(f"Token inválido: {tok}")
+    raise ValueError("Inalid Literal Token: next_byte=None")
+
+
+def _decode_fields(out: bytearray, tokens: TokenArray, stop: int) -> bool:
+
+    """Walk the columns token by token; False if a match reaches before the output."""
+
+    append = out.append
+    fields = zip(tokens.offsets, tokens.lengths, tokens.next_bytes, tokens.has_next)
+    if stop < len(tokens):
+        fields = islice(fields, stop)
+
+    for offset, length, next_byte, has in fields:
+        if length:
+            if offset > len(out):
+                return False
+            if length <= offset:
+                end = length - offset
+                out += out[-offset:end] if end else out[-offset:]
+            else:
+                out += _repeat_match(out, len(out) - offset, offset, length)
+            if has:
+                append(next_byte)
         else:
-            next_pos = pos + length
-            next_byte = data[next_pos] if next_pos < n else None
-            tokens.append(Token(offset, length, next_byte))
-            pos = next_pos + (1 if next_byte is not None else 0)
+            append(next_byte)
+    return True
 
-    return tokens
 
+def _decode_literal_runs(out: bytearray, tokens: TokenArray, match: np.ndarray, stop: int) -> bool:
 
-def decompress_lz77(tokens: List[Token]) -> bytes:
+    """Visit only the match tokens; the literals between two matches are one slice of next_bytes."""
 
-    out = bytearray()
+    offsets, lengths, _, has_next = tokens.columns()
+    next_bytes = tokens.next_bytes
+    append = out.append
+    prev = 0
+    with memoryview(next_bytes) as literals:
+        for k, offset, length, has in zip(
+            match.tolist(), offsets[match].tolist(), lengths[match].tolist(), has_next[match].tolist()
+        ):
+            if k > prev:
+                out += literals[prev:k]
+            if offset > len(out):
+                return False
+            if length <= offset:
+                end = length - offset
+                out += out[-offset:end] if end else out[-offset:]
+            else:
+                out += _repeat_match(out, len(out) - offset, offset, length)
+            if has:
+                append(next_bytes[k])
+            prev = k + 1
+        if prev < stop:
+            out += literals[prev:stop]
+    return True
+
+
+def _decode_columns(out: bytearray, tokens: TokenArray) -> None:
+
+    """_decode_into for a TokenArray without building Token objects. Literal-heavy
+    input copies whole runs of literals at once; otherwise the columns are walked
+    directly."""
+
+    n = len(tokens)
+    if n == 0:
+        return
+    start = len(out)
+    offsets, lengths, _, has_next = tokens.columns()
+    is_match = lengths != 0
+    bad = np.flatnonzero(np.where(is_match, offsets == 0, (offsets != 0) | (has_next == 0)))
+    stop = int(bad[0]) if len(bad) else n
+
+    match = np.flatnonzero(is_match[:stop])
+    if 2 * len(match) < stop:
+        ok = _decode_literal_runs(out, tokens, match, stop)
+    else:
+        ok = _decode_fields(out, tokens, stop)
+
+    if not ok:
+        # Every token has a non-zero size, so the output length pins down the offender
+        sizes = lengths[:stop].astype(np.int64) + has_next[:stop]
+        stop = int(np.searchsorted(np.cumsum(sizes), len(out) - start, side="right"))
+    if stop < n:
+        _raise_invalid_token(tokens[stop], len(out))
+
+
+def _decode_into(out: bytearray, tokens: Iterable[Token]) -> None:
 
+    if isinstance(tokens, TokenArray):
+        _decode_columns(out, tokens)
+        return
+
+    append = out.append
+
+    # Literals first: they are the common token on poorly compressible input
     for tok in tokens:
-        if tok.offset == 0 and tok.length == 0:
+        length = tok.length
+        if not length:
+            if tok.offset:
+                raise ValueError(f"Token inválido: {tok}")
             if tok.next_byte is None:
                 raise ValueError("Inalid Literal Token: next_byte=None")
-            out.append(tok.next_byte)
+            append(tok.next_byte)
             continue
 
-        if tok.offset <= 0 or tok.length <= 0:
+        offset = tok.offset
+        if offset <= 0 or length < 0:
             raise ValueError(f"Token inválido: {tok}")
+        if offset > len(out):
+            raise ValueError(f"Offset fuera de rango: {offset} con salida len={len(out)}")
 
-        start = len(out) - tok.offset
-        if start < 0:
-            raise ValueError(f"Offset fuera de rango: {tok.offset} con salida len={len(out)}")
-
-        # Copia con posible solapamiento
-        for i in range(tok.length):
-            out.append(out[start + i])
+        if length <= offset:
+            stop = length - offset
+            out += out[-offset:stop] if stop else out[-offset:]
+        else:
+            out += _repeat_match(out, len(out) - offset, offset, length)
 
         if tok.next_byte is not None:
-            out.append(tok.next_byte)
+            append(tok.next_byte)
+
 
+def decompress_lz77(tokens: List[Token], original_size: int | None = None) -> bytes:
+
+    out = bytearray()
+    _decode_into(out, tokens)
+    if original_size is not None and len(out) != original_size:
+        raise ValueError(f"Output size {len(out)} does not match the recorded original size {original_size}")
     return bytes(out)
 
 
-def tokens_to_bytes(tokens: List[Token]) -> bytes:
-    
+def decompress_bytes(blob: bytes) -> bytes:
+
+    """Decode a tokens_to_bytes blob; version >= 2 headers also check the output size."""
+
+    original_size = packed_header(blob)["original_size"] if _is_packed(blob) else None
+    return decompress_lz77(bytes_to_tokens(blob, compact=True), original_size)
+
+
+class LZ77Compressor:
+
+    """Incremental compress_lz77: memory stays around window + lookahead + one fed chunk."""
+
+    def __init__(self, window_size: int = 4096, lookahead_size: int = 18, max_chain: int = 64):
+        self.window_size = window_size
+        self.lookahead_size = lookahead_size
+        self._chain = _HashChain(window_size, max_chain)
+        self._buf = bytearray()
+        self._base = 0  # absolute position of self._buf[0]
+        self._pos = 0   # absolute position of the next byte to encode
+        self._finished = False
+
+    def feed(self, data: Buffer) -> List[Token]:
+
+        if self._finished:
+            raise ValueError("feed() called after flush()")
+        self._buf.extend(data)
+        return self._drain(final=False)
+
+    def flush(self) -> List[Token]:
+
+        if self._finished:
+            return []
+        tokens = self._drain(final=True)
+        self._finished = True
+        self._buf = bytearray()
+        return tokens
+
+    def _drain(self, final: bool) -> List[Token]:
+
+        tokens: List[Token] = []
+        buf = self._buf
+        base = self._base
+        pos = self._pos
+        end = base + len(buf)
+        # Mid-stream a token may need lookahead_size bytes plus its next_byte, and
+        # every position it covers must have its 3-byte hash key buffered, so only
+        # encode while that much is buffered; flush() takes the tail. This keeps
+        # the tokens identical to compress_lz77 on the whole input.
+        reserve = 0 if final else self.lookahead_size + MIN_MATCH
+
+        if end - pos > reserve:
+            append = tokens.append
+            pos = _greedy_run(self._chain, buf, pos, end - reserve, self.lookahead_size,
+                              lambda o, ln, nb: append(Token(o, ln, nb)), base)
+
+        # Drop bytes that fell out of the window, in batches of window_size
+        dead = pos - self.window_size - base
+        if dead >= self.window_size:
+            del buf[:dead]
+            base += dead
+
+        self._base = base
+        self._pos = pos
+        return tokens
+
+
+class LZ77Decompressor:
+
+    """Incremental decompress_lz77 keeping only the last window_size bytes of output."""
+
+    def __init__(self, window_size: int = 65535):
+        self.window_size = window_size
+        self._history = bytearray()
+
+    def feed(self, tokens: Iterable[Token]) -> bytes:
+
+        out = self._history
+        keep = len(out)
+        _decode_into(out, tokens)
+        chunk = bytes(out[keep:])
+        if len(out) > self.window_size:
+            del out[:len(out) - self.window_size]
+        return chunk
+
+    def flush(self) -> bytes:
+
+        self._history = bytearray()
+        return b""
+
+
+# Packed container (version 2). Version 1 is the headerless 4/5-byte record
+# stream; its 4th byte is always a 0/1 flag, so MAGIC + version >= 2 can never
+# be mistaken for an old blob.
+MAGIC = b"LZw"
+VERSION_PACKED = 2
+FLAG_HUFFMAN = 0x01
+FLAG_LAST_NO_NEXT = 0x02
+HUFFMAN_MAX_BITS = 15
+PACK_CHUNK = 1 << 16  # tokens serialized per vectorized pass
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(blob: bytes, i: int) -> Tuple[int, int]:
+
+    value = 0
+    shift = 0
+    while True:
+        if i >= len(blob):
+            raise ValueError("Truncated Blob")
+        b = blob[i]
+        i += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, i
+        shift += 7
+
+
+def _pack_bits(values: np.ndarray, widths: np.ndarray, bit_offset: int = 0) -> bytes:
+
+    """MSB-first concatenation of each value in its width of bits, starting bit_offset
+    bits into the first byte and zero-padded to a byte. Fields never share bits, so
+    per-byte sums (bincount) equal the bitwise or."""
+
+    keep = widths > 0
+    values = values[keep].astype(np.uint64)
+    widths = widths[keep].astype(np.int64)
+    if len(widths) == 0:
+        return b""
+    if widths.max() > 57:
+        raise ValueError("bit field wider than 57 bits")
+    ends = np.cumsum(widths) + bit_offset
+    starts = ends - widths
+    nbytes = (int(ends[-1]) + 7) >> 3
+
+    # Each field sits in a 64-bit big-endian window starting at its first byte
+    first = starts >> 3
+    window = values << (64 - (starts & 7) - widths).astype(np.uint64)
+    lanes = (7 + int(widths.max()) + 7) >> 3
+    out = np.zeros(nbytes + lanes, dtype=np.float64)
+    for lane in range(lanes):
+        part = (window >> np.uint64(56 - 8 * lane)) & np.uint64(0xFF)
+        out += np.bincount(first + lane, weights=part.astype(np.float64), minlength=len(out))
+    return out[:nbytes].astype(np.uint8).tobytes()
+
+
+def _append_bits(out: bytearray, bitpos: int, values: np.ndarray, widths: np.ndarray) -> int:
+
+    """Append fields to a bit stream whose last byte may be partly filled; returns the new bit length."""
+
+    part = _pack_bits(values, widths, bitpos & 7)
+    if part and bitpos & 7:
+        out[-1] |= part[0]
+        part = part[1:]
+    out += part
+    return bitpos + int(widths.sum(dtype=np.int64))
+
+
+def _read_bits(buf: np.ndarray, starts: np.ndarray, width: int) -> np.ndarray:
+
+    """The width-bit MSB-first field at each bit position in starts; buf must carry
+    8 bytes of zero padding past the furthest field."""
+
+    if width == 0:
+        return np.zeros(len(starts), dtype=np.int64)
+    first = starts >> 3
+    window = np.zeros(len(starts), dtype=np.uint64)
+    for lane in range(8):
+        window = (window << np.uint64(8)) | buf[first + lane]
+    shift = (64 - (starts & 7) - width).astype(np.uint64)
+    return ((window >> shift) & np.uint64((1 << width) - 1)).astype(np.int64)
+
+
+def _huffman_code_lengths(freqs: List[int], max_bits: int = HUFFMAN_MAX_BITS) -> List[int]:
+
+    while True:
+        lengths = [0] * len(freqs)
+        heap = [(f, sym, [sym]) for sym, f in enumerate(freqs) if f > 0]
+        if len(heap) == 1:
+            lengths[heap[0][1]] = 1
+            return lengths
+        heapq.heapify(heap)
+        while len(heap) > 1:
+            f1, k1, s1 = heapq.heappop(heap)
+            f2, k2, s2 = heapq.heappop(heap)
+            for sym in s1:
+                lengths[sym] += 1
+            for sym in s2:
+                lengths[sym] += 1
+            heapq.heappush(heap, (f1 + f2, min(k1, k2), s1 + s2))
+        if max(lengths, default=0) <= max_bits:
+            return lengths
+        # Flatten the distribution until the code fits in max_bits
+        freqs = [(f + 1) // 2 for f in freqs]
+
+
+def _canonical_codes(lengths: List[int]) -> List[int]:
+
+    codes = [0] * len(lengths)
+    code = 0
+    prev_len = 0
+    for sym in sorted((s for s in range(len(lengths)) if lengths[s]), key=lambda s: (lengths[s], s)):
+        code <<= lengths[sym] - prev_len
+        codes[sym] = code
+        code += 1
+        prev_len = lengths[sym]
+    return codes
+
+
+def _huffman_decode_table(lengths: List[int]) -> Tuple[List[int], List[int], int]:
+
+    max_len = max(lengths, default=0)
+    size = 1 << max_len
+    symbols = [-1] * size
+    sizes = [0] * size
+    for sym, code in enumerate(_canonical_codes(lengths)):
+        n = lengths[sym]
+        if n == 0:
+            continue
+        lo = code << (max_len - n)
+        hi = (code + 1) << (max_len - n)
+        if hi > size:
+            raise ValueError("Invalid Huffman table")
+        for k in range(lo, hi):
+            symbols[k] = sym
+            sizes[k] = n
+    return symbols, sizes, max_len
+
+
+def _check_packable(
+    offsets: np.ndarray,
+    lengths: np.ndarray,
+    next_bytes: np.ndarray,
+    has_next: np.ndarray,
+    is_tail: bool,
+    max_offset: int,
+    max_length: int
+) -> None:
+
+    """Validate one chunk at once; report its first offender like a sequential scan would."""
+
+    is_literal = (offsets == 0) & (lengths == 0)
+    no_next = has_next == 0
+    literal_no_next = is_literal & no_next
+    out_of_range = ~is_literal & ~(
+        (offsets >= 1) & (offsets <= max(max_offset, 1)) & (lengths >= 1) & (lengths <= max(max_length, 1))
+    )
+    early_no_next = no_next.copy()
+    if is_tail and len(early_no_next):
+        early_no_next[-1] = False
+    bad = np.flatnonzero(literal_no_next | out_of_range | early_no_next)
+    if len(bad):
+        k = int(bad[0])
+        if literal_no_next[k]:
+            raise ValueError("Inalid Literal Token: next_byte=None")
+        if out_of_range[k]:
+            t = Token(int(offsets[k]), int(lengths[k]), int(next_bytes[k]) if has_next[k] else None)
+            raise ValueError(f"Token out of range for this serialization: {t}")
+        raise ValueError("Only the last token may have next_byte=None")
+
+
+def _tokens_to_packed(
+    tokens: Iterable[Token],
+    window_size: int | None,
+    lookahead_size: int | None,
+    huffman: bool
+) -> bytes:
+
+    columns = tokens.columns() if isinstance(tokens, TokenArray) else _token_columns(tokens)
+    offsets, lengths, next_bytes, has_next = columns
+    n = len(offsets)
+    max_offset = window_size if window_size is not None else int(offsets.max(initial=1))
+    max_length = lookahead_size if lookahead_size is not None else int(lengths.max(initial=1))
+    offset_bits = (max(max_offset, 1) - 1).bit_length()
+    length_bits = (max(max_length, 1) - 1).bit_length()
+    n_symbols = 256 + max(max_length, 1)
+
+    # Every pass works on PACK_CHUNK tokens at a time so temporaries stay bounded
+    def chunks() -> Iterator[Tuple[int, np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        for k0 in range(0, n, PACK_CHUNK):
+            k1 = min(k0 + PACK_CHUNK, n)
+            yield (
+                k1,
+                offsets[k0:k1].astype(np.int64),
+                lengths[k0:k1].astype(np.int64),
+                next_bytes[k0:k1].astype(np.int64),
+                has_next[k0:k1].astype(np.int64),
+            )
+
+    freqs = np.zeros(n_symbols, dtype=np.int64)
+    for k1, off, ln, nb, hn in chunks():
+        _check_packable(off, ln, nb, hn, k1 == n, max_offset, max_length)
+        if huffman:
+            # DEFLATE-style merged alphabet: 0..255 literals, 256 + (length - 1) matches
+            freqs += np.bincount(ln[ln != 0] + 255, minlength=n_symbols)
+            freqs += np.bincount(nb[hn == 1], minlength=n_symbols)
+
+    flags = FLAG_LAST_NO_NEXT if n and has_next[-1] == 0 else 0
+    original_size = int(lengths.sum(dtype=np.int64)) + int(has_next.sum(dtype=np.int64))
+    if huffman:
+        flags |= FLAG_HUFFMAN
+        code_lengths = _huffman_code_lengths(freqs.tolist())
+        codes = np.array(_canonical_codes(code_lengths), dtype=np.int64)
+        code_lengths = np.array(code_lengths, dtype=np.int64)
+
+    out = bytearray(MAGIC)
+    out.append(VERSION_PACKED)
+    out.append(flags)
+    out.append(offset_bits)
+    out.append(length_bits)
+    _write_varint(out, n)
+    _write_varint(out, original_size)
+    if huffman:
+        _write_varint(out, n_symbols)
+    bitpos = len(out) * 8
+    if huffman:
+        bitpos = _append_bits(out, bitpos, code_lengths, np.full(n_symbols, 4, dtype=np.uint8))
+
+    # Up to four bit fields per token, in stream order; width 0 means absent
+    for _, off, ln, nb, hn in chunks():
+        is_match = ln != 0
+        values = np.zeros((len(ln), 4), dtype=np.int64)
+        widths = np.zeros((len(ln), 4), dtype=np.uint8)
+        if huffman:
+            sym = np.where(is_match, ln + 255, 0)
+            values[:, 0] = codes[sym]
+            widths[:, 0] = np.where(is_match, code_lengths[sym], 0)
+            values[:, 1] = off - 1
+            widths[:, 1] = np.where(is_match, offset_bits, 0)
+            values[:, 2] = codes[nb]
+            widths[:, 2] = np.where(hn == 1, code_lengths[nb], 0)
+        else:
+            # literal: flag bit 0 + byte; match: flag 1, offset, length, next_byte
+            values[:, 0] = np.where(is_match, 1, nb)
+            widths[:, 0] = np.where(is_match, 1, 9)
+            values[:, 1] = off - 1
+            widths[:, 1] = np.where(is_match, offset_bits, 0)
+            values[:, 2] = ln - 1
+            widths[:, 2] = np.where(is_match, length_bits, 0)
+            values[:, 3] = nb
+            widths[:, 3] = np.where(is_match & (hn == 1), 8, 0)
+        bitpos = _append_bits(out, bitpos, values.ravel(), widths.ravel())
+    return bytes(out)
+
+
+def _is_packed(blob: bytes) -> bool:
+    return len(blob) >= 4 and blob[:3] == MAGIC and blob[3] >= VERSION_PACKED
+
+
+def packed_header(blob: bytes) -> dict:
+
+    """Header fields of a version >= 2 blob (original_size, n_tokens, widths...)."""
+
+    if not _is_packed(blob):
+        raise ValueError("Not a packed LZ77 blob")
+    if blob[3] != VERSION_PACKED:
+        raise ValueError(f"Unsupported LZ77 container version: {blob[3]}")
+    if len(blob) < 7:
+        raise ValueError("Truncated Blob")
+    flags, offset_bits, length_bits = blob[4], blob[5], blob[6]
+    n_tokens, i = _read_varint(blob, 7)
+    original_size, i = _read_varint(blob, i)
+    n_symbols = 0
+    if flags & FLAG_HUFFMAN:
+        n_symbols, i = _read_varint(blob, i)
+    return {
+        "version": blob[3],
+        "flags": flags,
+        "offset_bits": offset_bits,
+        "length_bits": length_bits,
+        "n_tokens": n_tokens,
+        "original_size": original_size,
+        "n_symbols": n_symbols,
+        "payload_start": i,
+    }
+
+
+def _packed_to_tokens(blob: bytes) -> TokenArray:
+
+    h = packed_header(blob)
+    flags = h["flags"]
+    offset_bits = h["offset_bits"]
+    length_bits = h["length_bits"]
+    n = h["n_tokens"]
+    last_no_next = bool(flags & FLAG_LAST_NO_NEXT)
+    payload = bytes(blob[h["payload_start"]:])
+    limit = len(payload) * 8
+
+    if flags & FLAG_HUFFMAN:
+        header_bits = 4 * h["n_symbols"]
+        if header_bits > limit:
+            raise ValueError("Truncated Blob")
+        buf = np.frombuffer(payload + bytes(8), dtype=np.uint8)
+        lengths = _read_bits(buf, np.arange(0, header_bits, 4, dtype=np.int64), 4).tolist()
+        symbols, sizes, max_len = _huffman_decode_table(lengths)
+        return _huffman_tokens(payload, header_bits, n, offset_bits, last_no_next, symbols, sizes, max_len)
+
+    # Only the flag bits are sequential: walk them to find where each token starts
+    match_bits = 1 + offset_bits + length_bits + 8
+    starts = array("q")
+    p = 0
+    try:
+        for _ in range(n):
+            starts.append(p)
+            p += match_bits if (payload[p >> 3] >> (7 - (p & 7))) & 1 else 9
+    except IndexError:
+        raise ValueError("Truncated Blob") from None
+    # Fields are read for both token kinds, so pad past the longest record as well
+    buf = np.frombuffer(payload + bytes(8 + (match_bits + 7) // 8), dtype=np.uint8)
+    st = np.frombuffer(starts, dtype=np.int64)
+    is_match = _read_bits(buf, st, 1) == 1
+    has_next = np.ones(n, dtype=np.uint8)
+    if n and last_no_next and is_match[-1]:
+        has_next[-1] = 0
+        p -= 8
+    if p > limit:
+        raise ValueError("Truncated Blob")
+
+    offsets = np.where(is_match, _read_bits(buf, st + 1, offset_bits) + 1, 0)
+    lengths = np.where(is_match, _read_bits(buf, st + 1 + offset_bits, length_bits) + 1, 0)
+    next_bytes = np.where(is_match, _read_bits(buf, st + match_bits - 8, 8), _read_bits(buf, st + 1, 8))
+    next_bytes[has_next == 0] = 0
+    return TokenArray.from_columns(offsets, lengths, next_bytes, has_next)
+
+
+def _huffman_tokens(
+    payload: bytes,
+    start_bit: int,
+    n: int,
+    offset_bits: int,
+    last_no_next: bool,
+    symbols: List[int],
+    sizes: List[int],
+    max_len: int
+) -> TokenArray:
+
+    """Huffman payload decoder over an integer bit accumulator, refilled 64 bits at
+    a time so that every token is decoded without touching the buffer."""
+
+    out = TokenArray()
+    if n == 0:
+        return out
+    offsets_append = out.offsets.append
+    lengths_append = out.lengths.append
+    next_append = out.next_bytes.append
+    has_next_append = out.has_next.append
+    padded = payload + bytes(16)
+    limit = len(payload) * 8
+    code_mask = (1 << max_len) - 1
+    offset_mask = (1 << offset_bits) - 1
+    need = 2 * max_len + offset_bits
+
+    i = (start_bit >> 3) + 8
+    acc = int.from_bytes(padded[i - 8:i], "big")
+    nbits = 64 - (start_bit & 7)
+    last = n - 1 if last_no_next else -1
+    error = "Invalid Huffman code"
+
+    for k in range(n):
+        while nbits < need:
+            if i >= len(padded):
+                raise ValueError("Truncated Blob")
+            acc = ((acc & ((1 << nbits) - 1)) << 64) | int.from_bytes(padded[i:i + 8], "big")
+            i += 8
+            nbits += 64
+        c = (acc >> (nbits - max_len)) & code_mask
+        sym = symbols[c]
+        if sym < 0:
+            break
+        nbits -= sizes[c]
+        if sym < 256:
+            offsets_append(0)
+            lengths_append(0)
+            next_append(sym)
+            has_next_append(1)
+            continue
+        offsets_append(((acc >> (nbits - offset_bits)) & offset_mask) + 1)
+        lengths_append(sym - 255)
+        nbits -= offset_bits
+        if k == last:
+            next_append(0)
+            has_next_append(0)
+            continue
+        c = (acc >> (nbits - max_len)) & code_mask
+        sym = symbols[c]
+        if sym < 0:
+            break
+        nbits -= sizes[c]
+        if sym >= 256:
+            error = "Invalid next_byte symbol"
+            break
+        next_append(sym)
+        has_next_append(1)
+    else:
+        if i * 8 - nbits > limit:
+            raise ValueError("Truncated Blob")
+        return out
+
+    # Zero padding past the end decodes as garbage: report truncation instead
+    if i * 8 - nbits > limit:
+        raise ValueError("Truncated Blob")
+    raise ValueError(error)
+
+
+def tokens_to_bytes(
+    tokens: List[Token] | TokenArray,
+    version: int = 1,
+    window_size: int | None = None,
+    lookahead_size: int | None = None,
+    huffman: bool = False
+) -> bytes:
+
+    """version=1: fixed 4/5-byte records. version=2: bit-packed container with
+    widths from window_size/lookahead_size (or the token maxima) and an optional
+    static Huffman code over literals and match lengths."""
+
+    if version == VERSION_PACKED:
+        return _tokens_to_packed(tokens, window_size, lookahead_size, huffman)
+    if version != 1:
+        raise ValueError(f"Unsupported LZ77 container version: {version}")
+
+    if isinstance(tokens, TokenArray):
+        return tokens.to_bytes()
+
     out = bytearray()
     for t in tokens:
         if not (0 <= t.offset <= 65535):
@@ -115,26 +1277,393 @@ def tokens_to_bytes(tokens: List[Token]) -> bytes:
     return bytes(out)
 
 
-def bytes_to_tokens(blob: bytes) -> List[Token]:
+def _parse_tokens(blob: bytes) -> Tuple[List[Token], int]:
+
+    """Parse complete records from blob; returns the tokens and the bytes consumed."""
+
     tokens: List[Token] = []
     i = 0
-    while i < len(blob):
-        if i + 4 > len(blob):
-            raise ValueError("Truncated Blob")
+    n = len(blob)
+    while i + 4 <= n:
         offset = (blob[i] << 8) | blob[i + 1]
         length = blob[i + 2]
         flag = blob[i + 3]
-        i += 4
 
         if flag == 1:
             tokens.append(Token(offset, length, None))
+            i += 4
         elif flag == 0:
-            if i >= len(blob):
-                raise ValueError("Blob truncated (next_byte needed)")
-            next_byte = blob[i]
-            i += 1
-            tokens.append(Token(offset, length, next_byte))
+            if i + 4 >= n:
+                break
+            tokens.append(Token(offset, length, blob[i + 4]))
+            i += 5
         else:
             raise ValueError("Invalid Flag")
 
+    return tokens, i
+
+
+def bytes_to_tokens(blob: bytes, compact: bool = False) -> List[Token] | TokenArray:
+
+    if _is_packed(blob):
+        tokens = _packed_to_tokens(blob)
+        return tokens if compact else list(tokens)
+
+    if compact:
+        return TokenArray.from_bytes(blob)
+
+    tokens, used = _parse_tokens(blob)
+    if used < len(blob):
+        if len(blob) - used < 4:
+            raise ValueError("Truncated Blob")
+        raise ValueError("Blob truncated (next_byte needed)")
     return tokens
+
+
+def _read_chunks(f: BinaryIO, chunk_size: int) -> Iterator[bytes]:
+
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+# Framed stream (version 4): MAGIC, version, then one length-prefixed version 2
+# blob per fed chunk. Matches may reach back into earlier frames.
+VERSION_FRAMED = 4
+
+
+def _split_frames(pending: bytes) -> Tuple[List[bytes], int]:
+
+    """Complete varint-length frames at the start of pending, and the bytes they use."""
+
+    frames = []
+    i = 0
+    while True:
+        try:
+            size, j = _read_varint(pending, i)
+        except ValueError:
+            break
+        if j + size > len(pending):
+            break
+        frames.append(pending[j:j + size])
+        i = j + size
+    return frames, i
+
+
+def compress_file(
+    in_path,
+    out_path,
+    window_size: int = 4096,
+    lookahead_size: int = 18,
+    max_chain: int = 64,
+    chunk_size: int = 1 << 20,
+    version: int = VERSION_PACKED,
+    huffman: bool = True
+) -> Tuple[int, int]:
+
+    """Stream in_path through LZ77Compressor into out_path; returns (original, compressed) sizes.
+    version=2 writes a framed stream of version 2 blobs, version=1 the bare 4/5-byte records."""
+
+    if version not in (1, VERSION_PACKED):
+        raise ValueError(f"Unsupported LZ77 container version: {version}")
+
+    def encode(tokens: List[Token]) -> bytes:
+        if version == 1:
+            return tokens_to_bytes(tokens)
+        if not tokens:
+            return b""
+        blob = tokens_to_bytes(tokens, VERSION_PACKED, window_size, lookahead_size, huffman)
+        frame = bytearray()
+        _write_varint(frame, len(blob))
+        return bytes(frame) + blob
+
+    comp = LZ77Compressor(window_size, lookahead_size, max_chain)
+    n_in = n_out = 0
+    with open(in_path, "rb") as fin, open(out_path, "wb") as fout:
+        if version == VERSION_PACKED:
+            n_out += fout.write(MAGIC + bytes([VERSION_FRAMED]))
+        for chunk in _read_chunks(fin, chunk_size):
+            n_in += len(chunk)
+            n_out += fout.write(encode(comp.feed(chunk)))
+        n_out += fout.write(encode(comp.flush()))
+    return n_in, n_out
+
+
+def _decode_frame(dec: LZ77Decompressor, blob: bytes) -> bytes:
+
+    h = packed_header(blob)
+    dec.window_size = max(dec.window_size, 1 << h["offset_bits"])
+    chunk = dec.feed(bytes_to_tokens(blob, compact=True))
+    if len(chunk) != h["original_size"]:
+        raise ValueError(f"Output size {len(chunk)} does not match the recorded original size {h['original_size']}")
+    return chunk
+
+
+def decompress_file(in_path, out_path, chunk_size: int = 1 << 20) -> int:
+
+    """Stream a compress_file output (framed or bare records) from in_path back into
+    out_path; returns the output size."""
+
+    dec = LZ77Decompressor()
+    n_out = 0
+    with open(in_path, "rb") as fin, open(out_path, "wb") as fout:
+        pending = fin.read(len(MAGIC) + 1)
+        framed = pending == MAGIC + bytes([VERSION_FRAMED])
+        if framed:
+            pending = b""
+        for chunk in _read_chunks(fin, chunk_size):
+            pending += chunk
+            if framed:
+                frames, used = _split_frames(pending)
+                for blob in frames:
+                    n_out += fout.write(_decode_frame(dec, blob))
+            else:
+                tokens, used = _parse_tokens(pending)
+                n_out += fout.write(dec.feed(tokens))
+            pending = pending[used:]
+        if not framed:
+            # The header probe reads ahead, so a file that short is only parsed here
+            tokens, used = _parse_tokens(pending)
+            n_out += fout.write(dec.feed(tokens))
+            pending = pending[used:]
+        if pending:
+            if framed:
+                raise ValueError("Truncated Blob")
+            bytes_to_tokens(pending)  # raises the appropriate truncation error
+        n_out += fout.write(dec.flush())
+    return n_out
+
+
+# Block-framed container (version 3): MAGIC, version, flags, then independent
+# version 2 blobs, then the block index and a fixed-size trailer pointing at it.
+VERSION_BLOCKS = 3
+BLOCK_INDEX_ENTRY = struct.Struct(">QIQII")  # comp_offset, comp_size, raw_offset, raw_size, crc32
+BLOCK_TRAILER = struct.Struct(">QI4s")        # index_offset, n_blocks, trailer magic
+BLOCK_TRAILER_MAGIC = b"LZwI"
+
+
+@dataclass(frozen=True)
+class BlockEntry:
+    comp_offset: int
+    comp_size: int
+    raw_offset: int
+    raw_size: int
+    crc: int
+
+
+def _compress_block(args: Tuple[bytes, int, int, int, bool]) -> Tuple[bytes, int]:
+
+    block, window_size, lookahead_size, max_chain, huffman = args
+    tokens = compress_lz77(block, window_size, lookahead_size, max_chain)
+    blob = tokens_to_bytes(tokens, version=VERSION_PACKED, window_size=window_size,
+                           lookahead_size=lookahead_size, huffman=huffman)
+    return blob, zlib.crc32(block)
+
+
+def _decompress_block(blob: bytes) -> bytes:
+    return decompress_bytes(blob)
+
+
+def _ordered_map(fn: Callable, items: Iterable, workers: int | None) -> Iterator:
+
+    """Like Executor.map but keeps at most 2 * workers items in flight (bounded memory)."""
+
+    if workers == 1:
+        for item in items:
+            yield fn(item)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        pending: deque = deque()
+        for item in items:
+            pending.append(ex.submit(fn, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _write_blocks(
+    blocks: Iterable[bytes],
+    fout: BinaryIO,
+    window_size: int,
+    lookahead_size: int,
+    max_chain: int,
+    huffman: bool,
+    workers: int | None
+) -> Tuple[int, int]:
+
+    fout.write(MAGIC + bytes([VERSION_BLOCKS, 0]))
+    comp_offset = len(MAGIC) + 2
+    raw_offset = 0
+    index: List[BlockEntry] = []
+
+    def jobs() -> Iterator[Tuple[bytes, int, int, int, bool]]:
+        for block in blocks:
+            sizes.append(len(block))
+            yield block, window_size, lookahead_size, max_chain, huffman
+
+    sizes: deque = deque()
+    for blob, crc in _ordered_map(_compress_block, jobs(), workers):
+        raw_size = sizes.popleft()
+        fout.write(blob)
+        index.append(BlockEntry(comp_offset, len(blob), raw_offset, raw_size, crc))
+        comp_offset += len(blob)
+        raw_offset += raw_size
+
+    for e in index:
+        fout.write(BLOCK_INDEX_ENTRY.pack(e.comp_offset, e.comp_size, e.raw_offset, e.raw_size, e.crc))
+    fout.write(BLOCK_TRAILER.pack(comp_offset, len(index), BLOCK_TRAILER_MAGIC))
+    total = comp_offset + len(index) * BLOCK_INDEX_ENTRY.size + BLOCK_TRAILER.size
+    return raw_offset, total
+
+
+class BlockReader:
+
+    """Random access over a block-framed container (file path, file object or bytes)."""
+
+    def __init__(self, source):
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self._f = io.BytesIO(source)
+            self._owns = True
+        elif hasattr(source, "read"):
+            self._f = source
+            self._owns = False
+        else:
+            self._f = open(source, "rb")
+            self._owns = True
+
+        f = self._f
+        head = f.read(len(MAGIC) + 2)
+        if len(head) < len(MAGIC) + 2 or head[:3] != MAGIC or head[3] != VERSION_BLOCKS:
+            raise ValueError("Not a block-framed LZ77 container")
+
+        f.seek(0, io.SEEK_END)
+        end = f.tell()
+        if end < len(head) + BLOCK_TRAILER.size:
+            raise ValueError("Truncated Blob")
+        f.seek(end - BLOCK_TRAILER.size)
+        index_offset, n_blocks, magic = BLOCK_TRAILER.unpack(f.read(BLOCK_TRAILER.size))
+        if magic != BLOCK_TRAILER_MAGIC:
+            raise ValueError("Missing block index trailer")
+        if index_offset + n_blocks * BLOCK_INDEX_ENTRY.size + BLOCK_TRAILER.size != end:
+            raise ValueError("Corrupt block index")
+
+        f.seek(index_offset)
+        raw = f.read(n_blocks * BLOCK_INDEX_ENTRY.size)
+        self.index = [BlockEntry(*BLOCK_INDEX_ENTRY.unpack_from(raw, k * BLOCK_INDEX_ENTRY.size))
+                      for k in range(n_blocks)]
+        self._raw_starts = [e.raw_offset for e in self.index]
+        self.size = self.index[-1].raw_offset + self.index[-1].raw_size if self.index else 0
+
+    def close(self) -> None:
+        if self._owns:
+            self._f.close()
+
+    def __enter__(self) -> BlockReader:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _block_blob(self, e: BlockEntry) -> bytes:
+
+        self._f.seek(e.comp_offset)
+        blob = self._f.read(e.comp_size)
+        if len(blob) != e.comp_size:
+            raise ValueError("Truncated Blob")
+        return blob
+
+    def _check(self, e: BlockEntry, raw: bytes) -> bytes:
+
+        if len(raw) != e.raw_size or zlib.crc32(raw) != e.crc:
+            raise ValueError(f"CRC mismatch in block at raw offset {e.raw_offset}")
+        return raw
+
+    def read_block(self, k: int) -> bytes:
+
+        e = self.index[k]
+        return self._check(e, _decompress_block(self._block_blob(e)))
+
+    def read(self, offset: int, size: int) -> bytes:
+
+        """Decode only the blocks overlapping [offset, offset + size)."""
+
+        if offset < 0 or size < 0:
+            raise ValueError("offset and size must be non-negative")
+        end = min(offset + size, self.size)
+        if offset >= end:
+            return b""
+        first = bisect.bisect_right(self._raw_starts, offset) - 1
+        last = bisect.bisect_right(self._raw_starts, end - 1) - 1
+        parts = [self.read_block(k) for k in range(first, last + 1)]
+        joined = b"".join(parts)
+        base = self.index[first].raw_offset
+        return joined[offset - base:end - base]
+
+    def iter_blocks(self, workers: int | None = None) -> Iterator[bytes]:
+
+        blobs = (self._block_blob(e) for e in self.index)
+        for e, raw in zip(self.index, _ordered_map(_decompress_block, blobs, workers)):
+            yield self._check(e, raw)
+
+
+def compress_blocks(
+    data: bytes,
+    block_size: int = 1 << 20,
+    window_size: int = 4096,
+    lookahead_size: int = 18,
+    max_chain: int = 64,
+    huffman: bool = True,
+    workers: int | None = None
+) -> bytes:
+
+    """Compress independent block_size blocks across a process pool into a framed, seekable container."""
+
+    if block_size <= 0:
+        raise ValueError("block_size must be positive")
+    blocks = (data[k:k + block_size] for k in range(0, len(data), block_size))
+    out = io.BytesIO()
+    _write_blocks(blocks, out, window_size, lookahead_size, max_chain, huffman, workers)
+    return out.getvalue()
+
+
+def decompress_blocks(blob: bytes, workers: int | None = None) -> bytes:
+
+    with BlockReader(blob) as reader:
+        return b"".join(reader.iter_blocks(workers))
+
+
+def compress_file_blocks(
+    in_path,
+    out_path,
+    block_size: int = 1 << 20,
+    window_size: int = 4096,
+    lookahead_size: int = 18,
+    max_chain: int = 64,
+    huffman: bool = True,
+    workers: int | None = None
+) -> Tuple[int, int]:
+
+    """File-to-file compress_blocks; returns (original, compressed) sizes."""
+
+    if block_size <= 0:
+        raise ValueError("block_size must be positive")
+    with open(in_path, "rb") as fin, open(out_path, "wb") as fout:
+        return _write_blocks(_read_chunks(fin, block_size), fout, window_size,
+                             lookahead_size, max_chain, huffman, workers)
+
+
+def decompress_file_blocks(in_path, out_path, workers: int | None = None) -> int:
+
+    n_out = 0
+    with BlockReader(in_path) as reader, open(out_path, "wb") as fout:
+        for raw in reader.iter_blocks(workers):
+            n_out += fout.write(raw)
+    return n_out
@@ -1,16 +1,31 @@
+import argparse
+import csv
+import json
+import lzma
 import pathlib
-import tkinter as tk
-from tkinter import filedialog
+import random
+import resource
+import struct
+import sys
+import tempfile
+import time
+import zlib
 
 from LZ77_Algorithm import (
-    compress_lz77, decompress_lz77,
-    tokens_to_bytes, bytes_to_tokens
+    LEVEL_GREEDY, LEVEL_NAMES, VERSION_PACKED, LZ77Compressor,
+    compress_file, compress_lz77, decompress_bytes, decompress_file,
+    decompress_lz77, tokens_to_bytes
 )
 
+
 def seleccionar_archivo_pdf() -> pathlib.Path:
 
+    # tkinter is only needed for the interactive picker
+    import tkinter as tk
+    from tkinter import filedialog
+
     root = tk.Tk()
-    root.withdraw() 
+    root.withdraw()
 
     ruta = filedialog.askopenfilename(
         title="Select the file",
@@ -23,30 +38,37 @@ def seleccionar_archivo_pdf() -> pathlib.Path:
     return pathlib.Path(ruta)
 
 
-def main():
+def archivos_iguales(a: pathlib.Path, b: pathlib.Path, chunk_size: int = 1 << 20) -> bool:
+
+    with open(a, "rb") as fa, open(b, "rb") as fb:
+        while True:
+            ca = fa.read(chunk_size)
+            cb = fb.read(chunk_size)
+            if ca != cb:
+                return False
+            if not ca:
+                return True
+
 
-    in_path = seleccionar_archivo_pdf()
+def roundtrip(in_path: pathlib.Path, window_size: int = 8192, lookahead_size: int = 32) -> None:
 
     if not in_path.exists():
         raise FileNotFoundError(f"File do not exist: {in_path}")
 
     print(f"File selected: {in_path}")
 
-    data = in_path.read_bytes()
+    with tempfile.TemporaryDirectory() as tmp:
+        lz_path = pathlib.Path(tmp) / "data.lz77"
+        out_path = pathlib.Path(tmp) / "data.out"
 
-    tokens = compress_lz77(data, window_size=8192, lookahead_size=32)
+        original_size, compressed_size = compress_file(
+            in_path, lz_path, window_size=window_size, lookahead_size=lookahead_size
+        )
+        decompress_file(lz_path, out_path)
 
-    recovered = decompress_lz77(tokens)
-    assert recovered == data, "Failed:decompresion do not reconstruct the file exactly."
+        assert archivos_iguales(in_path, out_path), "Failed:decompresion do not reconstruct the file exactly."
 
-    compressed_blob = tokens_to_bytes(tokens)
-
-    roundtrip_tokens = bytes_to_tokens(compressed_blob)
-    assert decompress_lz77(roundtrip_tokens) == data, "Failed: unreversible token serialization."
-
-    original_size = len(data)
-    compressed_size = len(compressed_blob)
-    ratio = compressed_size / original_size
+    ratio = compressed_size / original_size if original_size else 1.0
 
     print("\nOK ✅ Roundtrip .")
     print(f"File: {in_path.name}")
@@ -56,5 +78,217 @@ def main():
     print(f"Space saving: {100*(1-ratio):.2f}% (if positive)")
 
 
+def tokens_streaming(data: bytes, window_size: int, lookahead_size: int, chunk_size: int) -> list:
+
+    comp = LZ77Compressor(window_size, lookahead_size)
+    tokens = []
+    for k in range(0, len(data), chunk_size):
+        tokens += comp.feed(data[k:k + chunk_size])
+    return tokens + comp.flush()
+
+
+def verificar_streaming(casos: int = 2000, seed: int = 0) -> None:
+
+    # Feeding LZ77Compressor in any chunking must give exactly the one-shot tokens
+    rng = random.Random(seed)
+    for _ in range(casos):
+        alphabet = rng.randint(1, 6)
+        data = bytes(rng.randrange(alphabet) for _ in range(rng.randint(0, 400)))
+        window_size = rng.choice([1, 2, 4, 16, 64, 300])
+        lookahead_size = rng.choice([1, 2, 3, 5, 18])
+        chunk_size = rng.choice([1, 2, 3, 7, 50, 1000])
+
+        expected = compress_lz77(data, window_size, lookahead_size)
+        got = tokens_streaming(data, window_size, lookahead_size, chunk_size)
+        assert got == expected, (
+            f"Streaming tokens differ from compress_lz77: data={data!r} "
+            f"window={window_size} lookahead={lookahead_size} chunk={chunk_size}"
+        )
+        assert decompress_lz77(got) == data
+
+    print(f"OK ✅ Streaming == one-shot on {casos} random cases.")
+
+
+def generar_corpus(size: int = 1 << 18, seed: int = 0) -> dict[str, bytes]:
+
+    rng = random.Random(seed)
+
+    letters = "abcdefghijklmnopqrstuvwxyzáéíóúñ"
+    vocab = ["".join(rng.choice(letters) for _ in range(rng.randint(1, 10))) for _ in range(2000)]
+    weights = [1.0 / (k + 1) for k in range(len(vocab))]  # Zipf-like word frequencies
+    text = bytearray()
+    while len(text) < size:
+        text += " ".join(rng.choices(vocab, weights=weights, k=64)).encode("utf-8") + b"\n"
+
+    # Fixed-width records with slowly varying fields, like a table dump
+    binary = bytearray()
+    k = 0
+    while len(binary) < size:
+        binary += struct.pack("<IfHB", k, k * 0.5, rng.randint(0, 50), k % 7)
+        k += 1
+
+    unit = bytes(rng.getrandbits(8) for _ in range(97))
+    repetitive = (unit * (size // len(unit) + 1))[:size]
+
+    return {
+        "text": bytes(text[:size]),
+        "binary": bytes(binary[:size]),
+        "random": rng.randbytes(size),
+        "repetitive": repetitive,
+    }
+
+
+def cargar_directorio(path: pathlib.Path) -> dict[str, bytes]:
+
+    return {p.name: p.read_bytes() for p in sorted(path.iterdir()) if p.is_file()}
+
+
+def peak_rss_mb() -> float:
+
+    # ru_maxrss is KiB on Linux and bytes on macOS; it only ever grows
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / 1024
+
+
+def _baseline(name: str, data: bytes, compress, decompress) -> dict:
+
+    t0 = time.perf_counter()
+    blob = compress(data)
+    t1 = time.perf_counter()
+    assert decompress(blob) == data
+    t2 = time.perf_counter()
+    mb = len(data) / 1e6
+    return {
+        "codec": name,
+        "compress_mb_s": mb / (t1 - t0) if t1 > t0 else float("inf"),
+        "decompress_mb_s": mb / (t2 - t1) if t2 > t1 else float("inf"),
+        "tokens_per_sec": None,
+        "compressed_bytes": len(blob),
+        "ratio": len(blob) / len(data) if data else 1.0,
+    }
+
+
+def bench_lz77(data: bytes, window_size: int, lookahead_size: int, level: int) -> dict:
+
+    # Both directions are timed bytes to bytes, like the zlib/lzma baselines
+    t0 = time.perf_counter()
+    tokens = compress_lz77(data, window_size, lookahead_size, level=level, compact=True)
+    t_parse = time.perf_counter()
+    v2 = tokens_to_bytes(tokens, version=VERSION_PACKED, window_size=window_size,
+                         lookahead_size=lookahead_size, huffman=True)
+    t1 = time.perf_counter()
+    recovered = decompress_bytes(v2)
+    t2 = time.perf_counter()
+    assert recovered == data, "Failed:decompresion do not reconstruct the data exactly."
+
+    v1 = tokens_to_bytes(tokens)
+    mb = len(data) / 1e6
+    return {
+        "codec": f"lz77-{LEVEL_NAMES[level]}",
+        "compress_mb_s": mb / (t1 - t0) if t1 > t0 else float("inf"),
+        "decompress_mb_s": mb / (t2 - t1) if t2 > t1 else float("inf"),
+        "tokens_per_sec": len(tokens) / (t_parse - t0) if t_parse > t0 else float("inf"),
+        "compressed_bytes": len(v2),
+        "ratio": len(v2) / len(data) if data else 1.0,
+        "ratio_v1": len(v1) / len(data) if data else 1.0,
+    }
+
+
+def run_benchmark(
+    corpus: dict[str, bytes],
+    window_sizes: list[int],
+    lookahead_sizes: list[int],
+    levels: list[int],
+    baselines: bool = True
+) -> list[dict]:
+
+    rows = []
+    for name, data in corpus.items():
+        cases = []
+        if baselines:
+            cases.append(lambda: _baseline("zlib-9", data, lambda d: zlib.compress(d, 9), zlib.decompress))
+            cases.append(lambda: _baseline("lzma-6", data, lzma.compress, lzma.decompress))
+        for w in window_sizes:
+            for la in lookahead_sizes:
+                for level in levels:
+                    cases.append(lambda w=w, la=la, level=level: {
+                        "window_size": w, "lookahead_size": la, **bench_lz77(data, w, la, level)
+                    })
+
+        for case in cases:
+            row = {"input": name, "bytes": len(data), "window_size": None, "lookahead_size": None}
+            row.update(case())
+            row["peak_rss_mb"] = peak_rss_mb()
+            rows.append(row)
+            print(
+                f"{name:>14} {row['codec']:>14} w={row['window_size'] or '-':>6} "
+                f"la={row['lookahead_size'] or '-':>4} "
+                f"comp {row['compress_mb_s']:8.3f} MB/s  dec {row['decompress_mb_s']:8.3f} MB/s  "
+                f"ratio {row['ratio']:.4f}  rss {row['peak_rss_mb']:.1f} MB"
+            )
+    return rows
+
+
+def guardar_resultados(rows: list[dict], json_path: pathlib.Path | None, csv_path: pathlib.Path | None) -> None:
+
+    if json_path is not None:
+        json_path.write_text(json.dumps(rows, indent=2), encoding="utf-8")
+    if csv_path is not None:
+        fields = []
+        for row in rows:
+            fields += [k for k in row if k not in fields]
+        with open(csv_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+
+    parser = argparse.ArgumentParser(description="LZ77 roundtrip check and benchmark suite")
+    sub = parser.add_subparsers(dest="command")
+
+    rt = sub.add_parser("roundtrip", help="compress/decompress one file and verify it")
+    rt.add_argument("path", nargs="?", type=pathlib.Path, help="input file (file dialog if omitted)")
+    rt.add_argument("--window", type=int, default=8192)
+    rt.add_argument("--lookahead", type=int, default=32)
+
+    check = sub.add_parser("check", help="streaming vs one-shot token equality on random inputs")
+    check.add_argument("--cases", type=int, default=2000)
+    check.add_argument("--seed", type=int, default=0)
+
+    bench = sub.add_parser("bench", help="benchmark over a directory or the generated corpus")
+    bench.add_argument("--dir", type=pathlib.Path, help="benchmark every file in this directory")
+    bench.add_argument("--size", type=int, default=1 << 18, help="bytes per generated corpus entry")
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--window", type=int, nargs="+", default=[4096, 8192])
+    bench.add_argument("--lookahead", type=int, nargs="+", default=[18, 32])
+    bench.add_argument("--level", type=int, nargs="+", default=[LEVEL_GREEDY], choices=sorted(LEVEL_NAMES))
+    bench.add_argument("--no-baselines", action="store_true", help="skip zlib/lzma")
+    bench.add_argument("--json", type=pathlib.Path)
+    bench.add_argument("--csv", type=pathlib.Path)
+
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None):
+
+    args = parse_args(argv)
+
+    if args.command == "check":
+        verificar_streaming(args.cases, args.seed)
+        return
+
+    if args.command == "bench":
+        corpus = cargar_directorio(args.dir) if args.dir else generar_corpus(args.size, args.seed)
+        rows = run_benchmark(corpus, args.window, args.lookahead, args.level, not args.no_baselines)
+        guardar_resultados(rows, args.json, args.csv)
+        return
+
+    path = getattr(args, "path", None)
+    in_path = path if path is not None else seleccionar_archivo_pdf()
+    roundtrip(in_path, getattr(args, "window", 8192), getattr(args, "lookahead", 32))
+
+
 if __name__ == "__main__":
     main()
@@ -1,6 +1,13 @@
+import bz2
+import lzma
+import re
+import struct
 import unicodedata as ud
 import zlib
 from dataclasses import dataclass
+from typing import Iterable
+
+import numpy as np
 
 COMB_ACUTE = "\u0301"      
 COMB_GRAVE = "\u0300"      
@@ -60,94 +67,484 @@ def unpack_pc(data: bytes, i: int) -> tuple[PackedChar, int]:
     return PackedChar(base_id, vq_id, tone_id, is_upper, is_d_stroke), i + 2
 
 
-def encode_vietnamese(text: str) -> bytes:
+def _encode_char(ch: str) -> bytes:
+
+    if ch in ("đ", "Đ"):
+        base = "d"
+        is_upper = 1 if ch == "Đ" else 0
+        pc = PackedChar(BASE_TO_ID[base], 0, 0, is_upper, 1)
+        return b"\x00" + pack_pc(pc)
+
+    nfd = ud.normalize("NFD", ch)
+    base = nfd[0]
+    marks = nfd[1:]
+
+    base_lower = base.lower()
+    if base_lower in BASE_TO_ID and base_lower != "_":
+
+        vq = None
+        tone = None
+        for m in marks:
+            if m in (COMB_BREVE, COMB_CIRC, COMB_HORN):
+                vq = m
+            elif m in (COMB_ACUTE, COMB_GRAVE, COMB_HOOK, COMB_TILDE, COMB_DOT):
+                tone = m
+
+        pc = PackedChar(
+            base_id=BASE_TO_ID[base_lower],
+            vq_id=VQ_TO_ID.get(vq, 0),
+            tone_id=TONE_TO_ID.get(tone, 0),
+            is_upper=1 if base.isupper() else 0,
+            is_d_stroke=0
+        )
+        return b"\x00" + pack_pc(pc)
+
+    b = ch.encode("utf-8")
+    return bytes([0xFF, len(b)]) + b
+
+
+def _vietnamese_letters() -> list[str]:
+
+    letters = ["đ", "Đ"]
+    for base in "aeiouyAEIOUY":
+        for vq in VQ_TO_ID:
+            for tone in TONE_TO_ID:
+                ch = ud.normalize("NFC", base + (vq or "") + (tone or ""))
+                if len(ch) == 1:
+                    letters.append(ch)
+    return letters
+
+
+# ord(ch) -> packed bytes as a latin-1 str, so a whole text is encoded with one
+# str.translate + encode("latin-1"). Seeded with ASCII and the Vietnamese
+# alphabet; any other character is added the first time it is seen.
+_ENCODE_TABLE: dict[int, str] = {
+    ord(ch): _encode_char(ch).decode("latin-1")
+    for ch in [chr(i) for i in range(128)] + _vietnamese_letters()
+}
 
-    out = bytearray()
-    for ch in text:
 
-        if ch in ("đ", "Đ"):
-            base = "d"
-            is_upper = 1 if ch == "Đ" else 0
-            pc = PackedChar(BASE_TO_ID[base], 0, 0, is_upper, 1)
-            out.append(0x00)
-            out.extend(pack_pc(pc))
-            continue
+# Format v2: a leading 0x02 byte (v1 streams start with a 0x00/0xFF tag), then
+#   0x00-0x7F          the ASCII character itself
+#   0x80-0xC2          one of the 67 lowercase Vietnamese letters (V2_LETTERS)
+#   0xFE c             the uppercase form of letter code c
+#   0xFF n <n bytes>   UTF-8 run of any other characters (1 <= n <= 255)
+V2_HEADER = b"\x02"
+V2_LETTER_BASE = 0x80
+V2_UPPER = 0xFE
+V2_RUN = 0xFF
+
+
+def _v2_letters() -> list[str]:
+
+    # Vowel qualities Vietnamese actually uses, times the 6 tones, minus plain ASCII
+    vowels = ["a", "a" + COMB_BREVE, "a" + COMB_CIRC, "e", "e" + COMB_CIRC, "i",
+              "o", "o" + COMB_CIRC, "o" + COMB_HORN, "u", "u" + COMB_HORN, "y"]
+    letters = ["đ"]
+    for v in vowels:
+        for tone in TONE_TO_ID:
+            ch = ud.normalize("NFC", v + (tone or ""))
+            if ch not in "aeiouy":
+                letters.append(ch)
+    return letters
+
+
+V2_LETTERS = _v2_letters()
+
+_V2_ENCODE_TABLE: dict[int, str] = {i: chr(i) for i in range(128)}
+for _code, _ch in enumerate(V2_LETTERS, V2_LETTER_BASE):
+    _V2_ENCODE_TABLE[ord(_ch)] = chr(_code)
+    _V2_ENCODE_TABLE[ord(_ch.upper())] = chr(V2_UPPER) + chr(_code)
+
+_V2_DECODE_TABLE: dict[int, str] = {_code: _ch for _code, _ch in enumerate(V2_LETTERS, V2_LETTER_BASE)}
+_V2_OTHER = re.compile("([^" + re.escape("".join(chr(c) for c in _V2_ENCODE_TABLE)) + "]+)")
+_V2_TAG = re.compile(rb"[\xc3-\xff]")
+
+
+def _v2_utf8_runs(run: str) -> str:
 
-        nfd = ud.normalize("NFD", ch)
-        base = nfd[0]
-        marks = nfd[1:]
-
-        base_lower = base.lower()
-        if base_lower in BASE_TO_ID and base_lower != "_":
-
-            vq = None
-            tone = None
-            for m in marks:
-                if m in (COMB_BREVE, COMB_CIRC, COMB_HORN):
-                    vq = m
-                elif m in (COMB_ACUTE, COMB_GRAVE, COMB_HOOK, COMB_TILDE, COMB_DOT):
-                    tone = m
-
-            pc = PackedChar(
-                base_id=BASE_TO_ID[base_lower],
-                vq_id=VQ_TO_ID.get(vq, 0),
-                tone_id=TONE_TO_ID.get(tone, 0),
-                is_upper=1 if base.isupper() else 0,
-                is_d_stroke=0
-            )
-            out.append(0x00)
-            out.extend(pack_pc(pc))
+    # Split at character boundaries into <= 255-byte chunks (UTF-8 continuation bytes are 10xxxxxx)
+    b = run.encode("utf-8")
+    out = []
+    i = 0
+    while i < len(b):
+        cut = min(i + 255, len(b))
+        while cut < len(b) and (b[cut] & 0xC0) == 0x80:
+            cut -= 1
+        out.append(bytes([V2_RUN, cut - i]) + b[i:cut])
+        i = cut
+    return b"".join(out).decode("latin-1")
+
+
+def _encode_v2(text: str) -> bytes:
+
+    parts = _V2_OTHER.split(text)
+    # split() with one group alternates known / other segments
+    for k in range(len(parts)):
+        parts[k] = _v2_utf8_runs(parts[k]) if k % 2 else parts[k].translate(_V2_ENCODE_TABLE)
+    return V2_HEADER + "".join(parts).encode("latin-1")
+
+
+def _decode_v2_from(data: bytes, i: int, final: bool = True) -> tuple[str, int]:
+
+    """Decode v2 records from offset i. With final=False an incomplete trailing
+    record is left unconsumed; returns (text, offset reached)."""
+
+    out = []
+    n = len(data)
+    while i < n:
+        m = _V2_TAG.search(data, i)
+        j = m.start() if m else n
+        if j > i:
+            out.append(data[i:j].decode("latin-1").translate(_V2_DECODE_TABLE))
+            i = j
+        if j >= n:
+            break
+
+        tag = data[j]
+        if tag == V2_UPPER:
+            if j + 1 >= n:
+                if not final:
+                    break
+                raise ValueError("Invalid uppercase code")
+            if data[j + 1] not in _V2_DECODE_TABLE:
+                raise ValueError("Invalid uppercase code")
+            out.append(_V2_DECODE_TABLE[data[j + 1]].upper())
+            i = j + 2
+        elif tag == V2_RUN:
+            if j + 1 >= n or j + 2 + data[j + 1] > n:
+                if not final:
+                    break
+                raise ValueError("Truncated UTF-8 run")
+            ln = data[j + 1]
+            out.append(bytes(data[j + 2:j + 2 + ln]).decode("utf-8"))
+            i = j + 2 + ln
         else:
+            raise ValueError(f"Unknown tag: {tag}")
+
+    return "".join(out), i
+
+
+def _decode_v2(data: bytes) -> str:
+    return _decode_v2_from(data, len(V2_HEADER))[0]
+
+
+def encode_vietnamese(text: str, version: int = 2) -> bytes:
+
+    if version == 2:
+        return _encode_v2(text)
+    if version != 1:
+        raise ValueError(f"Unsupported format version: {version}")
+
+    table = _ENCODE_TABLE
+    for ch in set(text):
+        if ord(ch) not in table:
+            table[ord(ch)] = _encode_char(ch).decode("latin-1")
+    return text.translate(table).encode("latin-1")
+
+
+def _decode_packed(b: int, meta: int) -> str:
 
-            b = ch.encode("utf-8")
-            out.append(0xFF)
-            out.append(len(b))
-            out.extend(b)
+    base = ID_TO_BASE[(b >> 5) & 0b111]
+    is_upper = (meta >> 1) & 1
 
-    return bytes(out)
+    if meta & 1 and base == "d":
+        return "Đ" if is_upper else "đ"
+
+    ch_base = base.upper() if is_upper else base
+    parts = [ch_base]
+    vq = ID_TO_VQ.get((b >> 3) & 0b11)
+    tone = ID_TO_TONE.get(b & 0b111)
+    if vq:
+        parts.append(vq)
+    if tone:
+        parts.append(tone)
+
+    return ud.normalize("NFC", "".join(parts))
+
+
+# Records of exactly 3 bytes -- packed letters (meta 0..3) and 1-byte UTF-8 (no NUL) --
+# decode in bulk: LUT index b << 2 | meta for packed, 1024 + byte for ASCII. Entries are
+# NUL-padded '<U3' (an NFC result can be up to 3 code points) and NULs are stripped
+# after the UTF-32 decode.
+_DECODE_LUT = np.array(
+    [_decode_packed(b, meta) for b in range(256) for meta in range(4)]
+    + [chr(c) for c in range(128)],
+    dtype="<U3"
+)
+_DECODE_LIST = _DECODE_LUT.tolist()
+_SHORT_RUN = 8  # shorter runs are cheaper to decode in Python than with NumPy
+
+
+def _lut_index(data: bytes, i: int) -> int:
+
+    """LUT index of the 3-byte record at i, or -1 if it is not one."""
+
+    tag = data[i]
+    if tag == 0x00:
+        meta = data[i + 2]
+        return (data[i + 1] << 2) | meta if meta <= 3 else -1
+    if tag == 0xFF and data[i + 1] == 1 and 0 < data[i + 2] < 0x80:
+        return 1024 + data[i + 2]
+    return -1
+
+
+def _run3_end(data: bytes, i: int) -> int:
+
+    # Gallop over the buffer in growing NumPy windows until a record breaks the run
+    n = len(data)
+    step = 64
+    while n - i >= 3:
+        k = min(step, (n - i) // 3)
+        rec = np.frombuffer(data, dtype=np.uint8, count=3 * k, offset=i).reshape(k, 3)
+        ok = ((rec[:, 0] == 0x00) & (rec[:, 2] <= 3)) | (
+            (rec[:, 0] == 0xFF) & (rec[:, 1] == 1) & (rec[:, 2] - 1 < 0x7F)
+        )
+        if not ok.all():
+            return i + 3 * int(np.argmin(ok))
+        i += 3 * k
+        step *= 2
+    return i
 
 
 def decode_vietnamese(data: bytes) -> str:
+    if data[:1] == V2_HEADER:
+        return _decode_v2(data)
+
     out_chars = []
     i = 0
-    while i < len(data):
+    n = len(data)
+    lut = _DECODE_LIST
+    while i < n:
+        # Short runs of 3-byte records straight from the Python LUT
+        k = 0
+        while k < _SHORT_RUN and n - i >= 3:
+            idx = _lut_index(data, i)
+            if idx < 0:
+                break
+            out_chars.append(lut[idx])
+            i += 3
+            k += 1
+
+        if k == _SHORT_RUN:
+            j = _run3_end(data, i)
+            if j > i:
+                rec = np.frombuffer(data, dtype=np.uint8, count=j - i, offset=i).reshape(-1, 3)
+                idx = np.where(
+                    rec[:, 0] == 0x00,
+                    (rec[:, 1].astype(np.int64) << 2) | rec[:, 2],
+                    1024 + rec[:, 2].astype(np.int64)
+                )
+                out_chars.append(_DECODE_LUT[idx].tobytes().decode("utf-32-le").replace("\x00", ""))
+                i = j
+            continue
+        if i >= n:
+            break
+
         tag = data[i]
         i += 1
         if tag == 0x00:
-            pc, i = unpack_pc(data, i)
-            base = ID_TO_BASE[pc.base_id]
-
-            if pc.is_d_stroke == 1 and base == "d":
-                ch = "Đ" if pc.is_upper else "đ"
-                out_chars.append(ch)
-                continue
-
-            ch_base = base.upper() if pc.is_upper else base
-            parts = [ch_base]
-            vq = ID_TO_VQ.get(pc.vq_id)
-            tone = ID_TO_TONE.get(pc.tone_id)
-            if vq:
-                parts.append(vq)
-            if tone:
-                parts.append(tone)
-
-            out_chars.append(ud.normalize("NFC", "".join(parts)))
+            out_chars.append(_decode_packed(data[i], data[i + 1]))
+            i += 2
         elif tag == 0xFF:
             ln = data[i]; i += 1
             b = data[i:i+ln]; i += ln
-            out_chars.append(b.decode("utf-8"))
+            out_chars.append(bytes(b).decode("utf-8"))
         else:
             raise ValueError(f"Unknown tag: {tag}")
 
     return "".join(out_chars)
 
-def compress_vietnamese(text: str, level: int = 9) -> bytes:
-    raw = encode_vietnamese(text)
-    return zlib.compress(raw, level)
+def compress_vietnamese(text: str, level: int = 9, zdict: bytes | None = None, backend: str = "zlib") -> bytes:
+
+    """One-shot VietnameseCompressor: the same "VNZ" stream that compress_file writes."""
+
+    comp = VietnameseCompressor(backend, level, zdict)
+    return comp.compress(text) + comp.flush()
+
+def decompress_vietnamese(blob: bytes, zdict: bytes | None = None) -> str:
+    if zdict is None and not blob.startswith(STREAM_MAGIC):
+        # Headerless zlib, as written before the stream container existed
+        return decode_vietnamese(zlib.decompress(blob))
+    dec = VietnameseDecompressor(zdict)
+    return dec.decompress(blob) + dec.flush()
+
+
+# Streaming container: MAGIC, version, backend id, adler32 of the preset
+# dictionary (0 = none), then the backend's compressed v2 stream.
+STREAM_MAGIC = b"VNZ"
+STREAM_HEADER = struct.Struct(">3sBBI")
+BACKENDS = {"zlib": 0, "bz2": 1, "lzma": 2}
+ID_TO_BACKEND = {v: k for k, v in BACKENDS.items()}
+
+
+def _make_compressor(backend: str, level: int, zdict: bytes | None):
+
+    if zdict is not None and backend != "zlib":
+        raise ValueError("A preset dictionary (zdict) is only supported by the zlib backend")
+    if backend == "zlib":
+        return zlib.compressobj(level, zdict=zdict) if zdict else zlib.compressobj(level)
+    if backend == "bz2":
+        return bz2.BZ2Compressor(max(1, min(level, 9)))
+    if backend == "lzma":
+        return lzma.LZMACompressor(preset=max(0, min(level, 9)))
+    raise ValueError(f"Unknown backend: {backend}")
 
-def decompress_vietnamese(blob: bytes) -> str:
-    raw = zlib.decompress(blob)
-    return decode_vietnamese(raw)
+
+def _make_decompressor(backend: str, zdict: bytes | None):
+
+    if backend == "zlib":
+        return zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+    if backend == "bz2":
+        return bz2.BZ2Decompressor()
+    if backend == "lzma":
+        return lzma.LZMADecompressor()
+    raise ValueError(f"Unknown backend: {backend}")
+
+
+class VietnameseCompressor:
+
+    """Incremental compress_vietnamese: text chunks are v2-encoded and fed to the backend."""
+
+    def __init__(self, backend: str = "zlib", level: int = 9, zdict: bytes | None = None):
+        self._backend = _make_compressor(backend, level, zdict)
+        self._header = STREAM_HEADER.pack(STREAM_MAGIC, 1, BACKENDS[backend], zlib.adler32(zdict) if zdict else 0)
+        self._started = False
+
+    def compress(self, text: str) -> bytes:
+
+        # v2 records never span characters, so chunks encode independently
+        raw = _encode_v2(text)
+        out = b""
+        if not self._started:
+            self._started = True
+            out = self._header
+        else:
+            raw = raw[len(V2_HEADER):]
+        return out + self._backend.compress(raw)
+
+    def flush(self) -> bytes:
+
+        out = b"" if self._started else self.compress("")
+        return out + self._backend.flush()
+
+
+class VietnameseDecompressor:
+
+    def __init__(self, zdict: bytes | None = None):
+        self._zdict = zdict
+        self._backend = None
+        self._head = b""
+        self._pending = b""  # decompressed bytes not yet forming a complete record
+
+    def decompress(self, blob: bytes) -> str:
+
+        if self._backend is None:
+            self._head += blob
+            if len(self._head) < STREAM_HEADER.size:
+                return ""
+            magic, version, backend_id, dict_id = STREAM_HEADER.unpack_from(self._head)
+            if magic != STREAM_MAGIC or version != 1 or backend_id not in ID_TO_BACKEND:
+                raise ValueError("Not a Vietnamese stream")
+            if dict_id != (zlib.adler32(self._zdict) if self._zdict else 0):
+                raise ValueError("Preset dictionary does not match the stream")
+            self._backend = _make_decompressor(ID_TO_BACKEND[backend_id], self._zdict)
+            blob = self._head[STREAM_HEADER.size:]
+            self._head = b""
+
+        if self._backend.eof:
+            if blob:
+                raise ValueError("Trailing data after Vietnamese stream")
+            return ""
+        return self._consume(self._pending + self._backend.decompress(blob), final=False)
+
+    def _consume(self, data: bytes, final: bool) -> str:
+
+        start = len(V2_HEADER)
+        if len(data) < start:
+            self._pending = data
+            return ""
+        if data[:start] != V2_HEADER:
+            raise ValueError("Corrupt Vietnamese stream")
+        text, i = _decode_v2_from(data, start, final)
+        self._pending = data[:start] + data[i:]
+        return text
+
+    def flush(self) -> str:
+
+        if self._backend is None:
+            raise ValueError("Truncated Vietnamese stream")
+        tail = b""
+        if hasattr(self._backend, "flush"):
+            tail = self._backend.flush()
+        if not self._backend.eof:
+            raise ValueError("Truncated Vietnamese stream")
+        if self._backend.unused_data:
+            raise ValueError("Trailing data after Vietnamese stream")
+        text = self._consume(self._pending + tail, final=True)
+        if len(self._pending) > len(V2_HEADER):
+            raise ValueError("Truncated Vietnamese stream")
+        return text
+
+
+def train_zdict(samples: Iterable[str], size: int = 32 * 1024) -> bytes:
+
+    """Preset dictionary from a sample corpus: the most frequent v2-encoded words,
+    most frequent last (zlib reaches the end of the dictionary with the shortest distances)."""
+
+    counts: dict[bytes, int] = {}
+    for text in samples:
+        for word in _encode_v2(text)[len(V2_HEADER):].split(b" "):
+            if word:
+                counts[word] = counts.get(word, 0) + 1
+
+    ranked = sorted(counts, key=lambda w: (counts[w] * (len(w) + 1), w), reverse=True)
+    chosen = []
+    total = 0
+    for word in ranked:
+        if total + len(word) + 1 > size:
+            continue
+        chosen.append(word)
+        total += len(word) + 1
+    return b"".join(w + b" " for w in reversed(chosen))
+
+
+def compress_file(
+    in_path,
+    out_path,
+    backend: str = "zlib",
+    level: int = 9,
+    zdict: bytes | None = None,
+    chunk_chars: int = 1 << 20
+) -> tuple[int, int]:
+
+    """Stream a UTF-8 text file into a compressed v2 stream; returns (chars read, bytes written)."""
+
+    comp = VietnameseCompressor(backend, level, zdict)
+    n_in = n_out = 0
+    with open(in_path, "r", encoding="utf-8", newline="") as fin, open(out_path, "wb") as fout:
+        while True:
+            chunk = fin.read(chunk_chars)
+            if not chunk:
+                break
+            n_in += len(chunk)
+            n_out += fout.write(comp.compress(chunk))
+        n_out += fout.write(comp.flush())
+    return n_in, n_out
+
+
+def decompress_file(in_path, out_path, zdict: bytes | None = None, chunk_size: int = 1 << 20) -> int:
+
+    dec = VietnameseDecompressor(zdict)
+    n_out = 0
+    with open(in_path, "rb") as fin, open(out_path, "w", encoding="utf-8", newline="") as fout:
+        while True:
+            chunk = fin.read(chunk_size)
+            if not chunk:
+                break
+            n_out += fout.write(dec.decompress(chunk))
+        n_out += fout.write(dec.flush())
+    return n_out
 
 
 if __name__ == "__main__":
@@ -169,4 +566,16 @@ if __name__ == "__main__":
         print("OK:", s)
         print("  bytes utf-8:", len(s.encode("utf-8")))
         print("  bytes encoded:", len(enc))
+        print("  bytes encoded (v1):", len(encode_vietnamese(s, version=1)))
         print("  bytes compressed:", len(comp))
+
+    zdict = train_zdict(samples)
+    for backend in BACKENDS:
+        comp = VietnameseCompressor(backend, zdict=zdict if backend == "zlib" else None)
+        blob = b"".join(comp.compress(s) for s in samples) + comp.flush()
+        dec = VietnameseDecompressor(zdict if backend == "zlib" else None)
+        text = "".join(dec.decompress(blob[k:k + 7]) for k in range(0, len(blob), 7)) + dec.flush()
+        assert text == "".join(samples)
+        print(f"stream {backend}: {len(blob)} bytes")
+    print("short message with zdict:", len(compress_vietnamese(samples[1], zdict=zdict)),
+          "without:", len(compress_vietnamese(samples[1])))
@@ -1,9 +1,23 @@
 import re
-import random
+import os
+import shutil
+import hashlib
 import pathlib
+import tempfile
 import tkinter as tk
+from array import array
+from collections.abc import Iterable, Iterator
 from tkinter import filedialog
-from pdfminer.high_level import extract_text
+from pdfminer.high_level import extract_pages, extract_text
+from pdfminer.layout import LTTextContainer
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-záéíóúüñ]+", flags=re.IGNORECASE)
+
+CACHE_DIR = pathlib.Path.home() / ".cache" / "abramson_corpus"
+CACHE_MAX_BYTES = 2 << 30
+CACHE_FORMAT = 1
 
 
 def seleccionar_pdf() -> pathlib.Path:
@@ -28,19 +42,45 @@ def extraer_texto_pdf(pdf_path: pathlib.Path) -> str:
     return extract_text(str(pdf_path))
 
 
+def iter_paginas_pdf(pdf_path: pathlib.Path) -> Iterator[str]:
+    # One page of text at a time; pdfminer parses pages lazily, so memory stays per-page
+    for pagina in extract_pages(str(pdf_path)):
+        yield "".join(el.get_text() for el in pagina if isinstance(el, LTTextContainer))
+
+
 def tokenizar_espanol(texto: str) -> list[str]:
-    texto = texto.lower()
-    return re.findall(r"[a-záéíóúüñ]+", texto, flags=re.IGNORECASE)
+    return TOKEN_RE.findall(texto.lower())
+
+
+def iter_tokens(paginas: Iterable[str]) -> Iterator[str]:
+    for texto in paginas:
+        for m in TOKEN_RE.finditer(texto.lower()):
+            yield m.group()
+
 
+def iter_conteos(paginas: Iterable[str], min_len: int = 1) -> Iterator[tuple[int, dict[str, int]]]:
+    # Online word counts: yields (pages read, counts so far) after every page.
+    # The same dict is updated in place, so copy it if a snapshot is needed.
+    freq: dict[str, int] = {}
+    n_pag = 0
+    for texto in paginas:
+        for m in TOKEN_RE.finditer(texto.lower()):
+            w = m.group()
+            if len(w) >= min_len:
+                freq[w] = freq.get(w, 0) + 1
+        n_pag += 1
+        yield n_pag, freq
 
-def construir_distribucion(tokens: list[str], min_len: int = 1) -> tuple[list[str], list[float]]:
-    if min_len > 1:
-        tokens = [w for w in tokens if len(w) >= min_len]
 
-    freq = {}
+def contar_frecuencias(tokens: Iterable[str], min_len: int = 1) -> dict[str, int]:
+    freq: dict[str, int] = {}
     for w in tokens:
-        freq[w] = freq.get(w, 0) + 1
+        if len(w) >= min_len:
+            freq[w] = freq.get(w, 0) + 1
+    return freq
 
+
+def distribucion_desde_conteos(freq: dict[str, int]) -> tuple[list[str], list[float]]:
     palabras = list(freq.keys())
     conteos = [freq[w] for w in palabras]
     total = sum(conteos)
@@ -48,34 +88,333 @@ def construir_distribucion(tokens: list[str], min_len: int = 1) -> tuple[list[st
     return palabras, probs
 
 
-def generar_quinta_aproximacion(palabras: list[str], probs: list[float], n_palabras: int = 400) -> str:
-    muestra = random.choices(palabras, weights=probs, k=n_palabras)
+def construir_distribucion(tokens: Iterable[str], min_len: int = 1) -> tuple[list[str], list[float]]:
+    return distribucion_desde_conteos(contar_frecuencias(tokens, min_len))
+
+
+def construir_corpus(
+    paginas: Iterable[str],
+    min_len: int = 1,
+    verbose: bool = False
+) -> tuple[list[str], np.ndarray, np.ndarray]:
+    # Vocabulary in first-seen order, per-word counts and the token stream as vocabulary ids;
+    # verbose reports progress every 50 pages
+    ids: dict[str, int] = {}
+    tokens = array("i")
+    for n_pag, texto in enumerate(paginas, 1):
+        for m in TOKEN_RE.finditer(texto.lower()):
+            w = m.group()
+            if len(w) >= min_len:
+                tokens.append(ids.setdefault(w, len(ids)))
+        if verbose and n_pag % 50 == 0:
+            print(f"  {n_pag} pages, {len(tokens):,} tokens, {len(ids):,} distinct words")
+
+    tokens = np.frombuffer(tokens, dtype=np.int32) if tokens else np.zeros(0, dtype=np.int32)
+    conteos = np.bincount(tokens, minlength=len(ids)).astype(np.int64)
+    return list(ids), conteos, tokens
+
+
+def hash_archivo(path: pathlib.Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def clave_cache(pdf_path: pathlib.Path, min_len: int = 1) -> str:
+    # Content hash plus everything that changes the tokens, so edits to the tokenizer miss the cache
+    ajustes = f"{CACHE_FORMAT}|{TOKEN_RE.pattern}|{TOKEN_RE.flags}|lower|{min_len}"
+    return hashlib.sha256(f"{hash_archivo(pdf_path)}|{ajustes}".encode("utf-8")).hexdigest()[:32]
+
+
+def cargar_cache(clave: str, cache_dir: pathlib.Path = CACHE_DIR) -> tuple[list[str], np.ndarray, np.ndarray] | None:
+    entrada = cache_dir / clave
+    try:
+        palabras = (entrada / "vocab.txt").read_text(encoding="utf-8").split("\n")[:-1]
+        conteos = np.load(entrada / "counts.npy", mmap_mode="r")
+        tokens = np.load(entrada / "tokens.npy", mmap_mode="r")
+    except (FileNotFoundError, ValueError):
+        return None
+    if len(palabras) != len(conteos):
+        return None
+
+    os.utime(entrada)  # directory mtime is the LRU clock
+    return palabras, conteos, tokens
+
+
+def _tamano_entrada(entrada: pathlib.Path) -> int:
+    return sum(f.stat().st_size for f in entrada.iterdir())
+
+
+def podar_cache(cache_dir: pathlib.Path = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES) -> None:
+    # Least recently used entries go first until the cache fits in max_bytes;
+    # the most recent one is always kept
+    entradas = sorted((e for e in cache_dir.iterdir() if e.is_dir() and not e.name.startswith(".")),
+                      key=lambda e: e.stat().st_mtime, reverse=True)
+    total = 0
+    for k, entrada in enumerate(entradas):
+        total += _tamano_entrada(entrada)
+        if k and total > max_bytes:
+            shutil.rmtree(entrada, ignore_errors=True)
+
+
+def guardar_cache(
+    clave: str,
+    palabras: list[str],
+    conteos: np.ndarray,
+    tokens: np.ndarray,
+    cache_dir: pathlib.Path = CACHE_DIR,
+    max_bytes: int = CACHE_MAX_BYTES
+) -> None:
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # Written beside the cache and renamed in, so readers never see a half-written entry
+    tmp = pathlib.Path(tempfile.mkdtemp(prefix=".tmp-", dir=cache_dir))
+    try:
+        (tmp / "vocab.txt").write_text("".join(w + "\n" for w in palabras), encoding="utf-8")
+        np.save(tmp / "counts.npy", np.asarray(conteos, dtype=np.int64))
+        np.save(tmp / "tokens.npy", np.asarray(tokens, dtype=np.int32))
+        try:
+            os.replace(tmp, cache_dir / clave)
+        except OSError:
+            pass  # another run stored the same entry first
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    podar_cache(cache_dir, max_bytes)
+
+
+def corpus_pdf(
+    pdf_path: pathlib.Path,
+    min_len: int = 1,
+    cache_dir: pathlib.Path | None = CACHE_DIR,
+    max_bytes: int = CACHE_MAX_BYTES,
+    verbose: bool = False
+) -> tuple[list[str], np.ndarray, np.ndarray]:
+    if cache_dir is None:
+        return construir_corpus(iter_paginas_pdf(pdf_path), min_len, verbose)
+
+    clave = clave_cache(pdf_path, min_len)
+    cacheado = cargar_cache(clave, cache_dir)
+    if cacheado is not None:
+        return cacheado
+
+    palabras, conteos, tokens = construir_corpus(iter_paginas_pdf(pdf_path), min_len, verbose)
+    guardar_cache(clave, palabras, conteos, tokens, cache_dir, max_bytes)
+    return palabras, conteos, tokens
+
 
-    lineas = []
-    linea = []
-    for w in muestra:
-        linea.append(w)
-        if len(linea) >= 12:
-            lineas.append(" ".join(linea))
-            linea = []
-    if linea:
-        lineas.append(" ".join(linea))
-    return "\n".join(lineas)
+class AliasSampler:
+    # Walker's alias method: O(n) setup, then O(1) per draw (one uniform bucket plus one coin)
+
+    def __init__(self, palabras: list[str], probs, seed: int | np.random.Generator | None = None):
+        p = np.asarray(probs, dtype=np.float64)
+        if len(palabras) != len(p) or len(p) == 0:
+            raise ValueError("palabras and probs must be non-empty and of the same length")
+        if (p < 0).any() or p.sum() <= 0:
+            raise ValueError("probs must be non-negative with a positive sum")
+
+        self.palabras = np.array(palabras, dtype=object)
+        self.rng = np.random.default_rng(seed)
+        self.prob, self.alias = self._tablas(p / p.sum())
+
+    @staticmethod
+    def _tablas(p: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Vose's variant, stable with floating point leftovers
+        n = len(p)
+        prob = p * n
+        alias = np.arange(n, dtype=np.int64)
+        pequenos = np.flatnonzero(prob < 1.0).tolist()
+        grandes = np.flatnonzero(prob >= 1.0).tolist()
+        q = prob.tolist()
+        while pequenos and grandes:
+            s = pequenos.pop()
+            g = grandes[-1]
+            alias[s] = g
+            q[g] -= 1.0 - q[s]
+            if q[g] < 1.0:
+                pequenos.append(grandes.pop())
+        prob = np.asarray(q)
+        prob[grandes + pequenos] = 1.0
+        return prob, alias
+
+    def muestrear(self, k: int) -> np.ndarray:
+        i = self.rng.integers(0, len(self.prob), size=k)
+        return np.where(self.rng.random(k) < self.prob[i], i, self.alias[i])
+
+    def generar_texto(self, n_palabras: int, palabras_por_linea: int = 12) -> str:
+        return unir_lineas(self.palabras[self.muestrear(n_palabras)], palabras_por_linea)
+
+
+def unir_lineas(palabras: np.ndarray, palabras_por_linea: int = 12) -> str:
+    if len(palabras) == 0:
+        return ""
+    partes = np.empty(2 * len(palabras) - 1, dtype=object)
+    partes[0::2] = palabras
+    partes[1::2] = " "
+    partes[2 * palabras_por_linea - 1::2 * palabras_por_linea] = "\n"
+    return "".join(partes.tolist())
+
+
+def generar_quinta_aproximacion(
+    palabras: list[str],
+    probs: list[float],
+    n_palabras: int = 400,
+    seed: int | None = None
+) -> str:
+    return AliasSampler(palabras, probs, seed).generar_texto(n_palabras)
+
+
+class MarkovModel:
+    # Order-k model over vocabulary ids, stored CSR-style: contexts are mixed-radix int64 keys
+    # (sorted), and row r owns successors[indptr[r]:indptr[r+1]] with cumulative counts in acum.
+
+    def __init__(self, orden: int, n_vocab: int, claves, indptr, sucesores, acum):
+        self.orden = orden
+        self.n_vocab = n_vocab
+        self.claves = claves
+        self.indptr = indptr
+        self.sucesores = sucesores
+        self.acum = acum
+
+    @classmethod
+    def desde_tokens(cls, tokens, n_vocab: int, orden: int) -> "MarkovModel":
+        tokens = np.asarray(tokens)
+        if orden < 1:
+            raise ValueError("orden must be >= 1")
+        if n_vocab ** orden >= 1 << 63:
+            raise ValueError("n_vocab ** orden does not fit in an int64 context key")
+        n = len(tokens) - orden
+        if n <= 0:
+            raise ValueError("Not enough tokens for this order")
+
+        claves = np.zeros(n, dtype=np.int64)
+        for j in range(orden):
+            claves = claves * n_vocab + tokens[j:j + n]
+        sucesores = tokens[orden:].astype(np.int32)
+
+        orden_idx = np.lexsort((sucesores, claves))
+        claves = claves[orden_idx]
+        sucesores = sucesores[orden_idx]
+        del orden_idx
+
+        # One entry per distinct (context, successor) pair, then one row per distinct context
+        nuevo = np.ones(n, dtype=bool)
+        nuevo[1:] = (claves[1:] != claves[:-1]) | (sucesores[1:] != sucesores[:-1])
+        inicio_par = np.flatnonzero(nuevo)
+        claves = claves[inicio_par]
+        sucesores = sucesores[inicio_par]
+        acum = np.append(inicio_par[1:], n).astype(np.int64)  # running count = position of the next pair
+
+        nuevo = np.ones(len(claves), dtype=bool)
+        nuevo[1:] = claves[1:] != claves[:-1]
+        inicio_fila = np.flatnonzero(nuevo)
+        indptr = np.append(inicio_fila, len(claves)).astype(np.int64)
+        return cls(orden, n_vocab, claves[inicio_fila], indptr, sucesores, acum)
+
+    @property
+    def n_contextos(self) -> int:
+        return len(self.claves)
+
+    def _fila(self, clave: int) -> int:
+        r = int(np.searchsorted(self.claves, clave))
+        return r if r < len(self.claves) and self.claves[r] == clave else -1
+
+    def _contexto(self, r: int) -> list[int]:
+        clave = int(self.claves[r])
+        ids = []
+        for _ in range(self.orden):
+            clave, t = divmod(clave, self.n_vocab)
+            ids.append(t)
+        return ids[::-1]
+
+    def _fila_al_azar(self, rng: np.random.Generator) -> int:
+        # Contexts drawn in proportion to their corpus frequency
+        par = int(np.searchsorted(self.acum, rng.integers(self.acum[-1]), side="right"))
+        return int(np.searchsorted(self.indptr, par, side="right")) - 1
+
+    def generar(self, n: int, seed: int | np.random.Generator | None = None, inicio=None) -> np.ndarray:
+        rng = np.random.default_rng(seed)
+        if inicio is None:
+            fila = self._fila_al_azar(rng)
+            salida = self._contexto(fila)
+        else:
+            salida = [int(t) for t in inicio][-self.orden:]
+            if len(salida) != self.orden:
+                raise ValueError(f"inicio needs {self.orden} ids")
+        clave = 0
+        for t in salida:
+            clave = clave * self.n_vocab + t
+        fila = self._fila(clave)
+
+        radix = self.n_vocab ** (self.orden - 1)
+        acum, indptr, sucesores = self.acum, self.indptr, self.sucesores
+        while len(salida) < n:
+            if fila < 0:
+                # Unseen context (only the corpus' last one can be): restart elsewhere
+                fila = self._fila_al_azar(rng)
+                clave = int(self.claves[fila])
+            a, b = int(indptr[fila]), int(indptr[fila + 1])
+            base = int(acum[a - 1]) if a else 0
+            u = base + int(rng.integers(int(acum[b - 1]) - base))
+            t = int(sucesores[a + int(np.searchsorted(acum[a:b], u, side="right"))])
+            salida.append(t)
+            clave = (clave % radix) * self.n_vocab + t
+            fila = self._fila(clave)
+        return np.asarray(salida[:n], dtype=np.int64)
+
+
+def tokens_a_caracteres(palabras: list[str], tokens) -> tuple[list[str], np.ndarray]:
+    # Character stream of the corpus (words separated by one space) without building the text
+    alfabeto = sorted(set("".join(palabras)) | {" "})
+    ids = {c: i for i, c in enumerate(alfabeto)}
+    codigos = [np.array([ids[c] for c in w + " "], dtype=np.int32) for w in palabras]
+    plano = np.concatenate(codigos)
+    largos = np.array([len(c) for c in codigos], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(largos)[:-1]))
+
+    tokens = np.asarray(tokens)
+    largo_tok = largos[tokens]
+    inicio_salida = np.cumsum(largo_tok) - largo_tok
+    idx = np.repeat(offsets[tokens] - inicio_salida, largo_tok) + np.arange(int(largo_tok.sum()))
+    return alfabeto, plano[idx]
+
+
+def aproximacion_palabras(
+    palabras: list[str],
+    tokens,
+    orden: int = 1,
+    n_palabras: int = 400,
+    seed: int | None = None
+) -> str:
+    # orden=k conditions each word on the previous k (Shannon's order-(k+1) word approximation)
+    modelo = MarkovModel.desde_tokens(tokens, len(palabras), orden)
+    return unir_lineas(np.array(palabras, dtype=object)[modelo.generar(n_palabras, seed)])
+
+
+def aproximacion_caracteres(
+    palabras: list[str],
+    tokens,
+    orden: int = 3,
+    n_caracteres: int = 2000,
+    seed: int | None = None
+) -> str:
+    alfabeto, chars = tokens_a_caracteres(palabras, tokens)
+    modelo = MarkovModel.desde_tokens(chars, len(alfabeto), orden)
+    return "".join(np.array(alfabeto, dtype=object)[modelo.generar(n_caracteres, seed)].tolist())
 
 
 def main():
     pdf_path = seleccionar_pdf()
     print(f"PDF selected: {pdf_path}")
 
-    texto = extraer_texto_pdf(pdf_path)
-    tokens = tokenizar_espanol(texto)
+    palabras, conteos, tokens = corpus_pdf(pdf_path, verbose=True)
 
     if len(tokens) < 1000:
         print("Warning: the PDF extracted few tokens; the result could be poor.")
 
-    palabras, probs = construir_distribucion(tokens)
-
-    salida = generar_quinta_aproximacion(palabras, probs, n_palabras=500)
+    salida = AliasSampler(palabras, conteos).generar_texto(500)
 
     out_path = pdf_path.with_suffix(".quinta_aprox.txt")
     out_path.write_text(salida, encoding="utf-8")
@@ -84,6 +423,14 @@ def main():
     print(salida[:1200], "...\n")
     print(f"Saved in: {out_path}")
 
+    if len(tokens) > 2:
+        salida = aproximacion_palabras(palabras, tokens, orden=2, n_palabras=500)
+        out_path = pdf_path.with_suffix(".orden3_aprox.txt")
+        out_path.write_text(salida, encoding="utf-8")
+        print("\nOrder-3 word approximation (sample):\n")
+        print(salida[:1200], "...\n")
+        print(f"Saved in: {out_path}")
+
 
 if __name__ == "__main__":
     main()